@@ -0,0 +1,210 @@
+"""
+benchmark suite for make_plot, repeat_plot and make_panel
+
+* synthetic datasets ``[x, y, dx, dy1, dy2]`` w/ error bars, systematic
+  uncertainty boxes and points whose error bar reaches below zero (limit
+  arrows on log y-axes)
+* cases: make_plot and repeat_plot for 10^2 to 10^7 points on linear and log
+  axes, make_panel from 1x1 to 8x8 subplots
+* each case runs in its own process (peak RSS per case) w/ output to a
+  temporary directory and the ascii plots of the dumb terminal discarded,
+  timing ends once gnuplot processed all commands
+* reported: wall time, throughput (points/s), mean latency of each stage (see
+  timing.py) and peak RSS of python and its child processes
+* results can be saved as json and compared to a saved baseline
+
+run from the command line::
+
+  python bench.py [--sizes 2 3 4] [--panels 1x1 4x4] [--no-convert]
+                  [--save <json>] [--baseline <json>] [--threshold 1.2]
+"""
+
+import os, sys, json, time, shutil, tempfile, resource
+import numpy as np
+from multiprocessing import Process, Queue
+from ccsgp import make_plot, repeat_plot, make_panel
+from pool import gnuplot_pool
+from gpbuffer import sync
+from gsbatch import gs_batch
+from utils import getOpts
+from collections import OrderedDict
+import postproc
+
+def synthetic(n, seed = 0):
+  """synthetic dataset w/ ``n`` points in the format [x, y, dx, dy1, dy2]
+
+  every 20th point gets an error bar reaching below zero
+  """
+  rs = np.random.RandomState(seed)
+  x = np.sort(rs.uniform(0.1, 100., n))
+  y = np.exp(-x / 20.) * (1. + 0.1 * rs.randn(n)).clip(0.5) + 1e-3
+  dy1 = np.abs(0.1 * y * rs.randn(n))
+  dy1[::20] = 1.5 * y[::20]
+  return np.column_stack((x, y, 0.005 * x, dy1, 0.05 * y))
+
+def _options(name, log):
+  return dict(
+    name = name, xlog = log, ylog = log, xlabel = 'x', ylabel = 'y',
+    key = ['top right'], gpcalls = ['boxwidth 0.01 absolute']
+  )
+
+def _sync():
+  """wait until all idle gnuplot sessions processed the commands sent"""
+  for i in xrange(gnuplot_pool.stats()['idle']):
+    gp = gnuplot_pool.acquire()
+    sync(gp)
+    gnuplot_pool.release(gp)
+
+def _plot(npoints, log):
+  plt = make_plot([synthetic(npoints)], [getOpts(0)], ['data'], **_options('plot', log))
+  plt.close()
+  return npoints, plt.timer.records
+
+def _repeat(npoints, log):
+  plt = make_plot([synthetic(npoints)], [getOpts(0)], ['data'], **_options('plot', log))
+  _sync()
+  nrec, t0 = len(plt.timer.records), time.time()
+  repeat_plot(plt, 'repeat', **dict(_options('repeat', log), yr = [1e-3, 2.]))
+  plt.close()
+  return npoints, plt.timer.records[nrec:], t0
+
+def _panel(layout, npoints, log):
+  nx, ny = map(int, layout.split('x'))
+  dpt_dict = OrderedDict(
+    ('%d' % i, [[synthetic(npoints, seed = i)], [getOpts(i)], ['data %d' % i]])
+    for i in xrange(nx * ny)
+  )
+  pp = make_panel(dpt_dict, layout = layout, **_options('panel', log))
+  return nx * ny * npoints, pp.timer.records
+
+_kinds = { 'plot': _plot, 'repeat': _repeat, 'panel': _panel }
+
+def _run_case(case, queue):
+  """run one case in a fresh process and put its result into ``queue``"""
+  devnull = os.open(os.devnull, os.O_WRONLY)
+  os.dup2(devnull, 1) # ascii plots of the dumb terminal
+  workdir = tempfile.mkdtemp(prefix = 'ccsgp_bench_')
+  try:
+    os.chdir(workdir)
+    postproc.run_converters = case['convert']
+    t0 = time.time()
+    result = _kinds[case['kind']](*case['args'])
+    if len(result) > 2: t0 = result[2] # exclude setup
+    _sync()
+    wall = time.time() - t0
+    gnuplot_pool.clear()
+    gs_batch.clear() # reaped, i.e. counted in child_maxrss
+    stages = {}
+    for r in result[1]:
+      s = stages.setdefault(r['stage'], [0, 0.])
+      s[0] += 1
+      s[1] += r['wall']
+    queue.put(dict(
+      case = case['name'], wall = wall, points = result[0],
+      throughput = result[0] / wall,
+      stages = dict((k, t / n) for k, (n, t) in stages.iteritems()),
+      maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+      child_maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.
+    ))
+  except Exception as e:
+    queue.put(dict(case = case['name'], error = repr(e)))
+  finally:
+    shutil.rmtree(workdir, ignore_errors = True)
+
+def cases(sizes = range(2, 8), panels = ['1x1', '2x2', '4x4', '8x8'],
+          panel_points = 1000, convert = True):
+  """list of benchmark cases
+
+  :param sizes: exponents of the number of points for make_plot/repeat_plot
+  :type sizes: list
+  :param panels: panel layouts '<cols>x<rows>'
+  :type panels: list
+  :param panel_points: number of points per subplot
+  :type panel_points: int
+  :param convert: run gs/convert (see config.run_converters)
+  :type convert: bool
+  """
+  cs = []
+  for axes, log in [('lin', False), ('log', True)]:
+    for kind in ['plot', 'repeat']:
+      for e in sizes:
+        cs.append(dict(name = '%s-%s-1e%d' % (kind, axes, e), kind = kind, args = (10**e, log)))
+    for layout in panels:
+      cs.append(dict(name = 'panel-%s-%s' % (axes, layout), kind = 'panel', args = (layout, panel_points, log)))
+  for c in cs: c['convert'] = convert
+  return cs
+
+def run(cases):
+  """run benchmark cases one after the other, each in its own process
+
+  :returns: list of result dicts (wall, points, throughput, stages, maxrss,
+    child_maxrss in s, points/s and MB) or dicts w/ error
+  """
+  results = []
+  for case in cases:
+    queue = Queue()
+    p = Process(target = _run_case, args = (case, queue))
+    p.start()
+    results.append(queue.get())
+    p.join()
+  return results
+
+def compare(results, baseline, threshold = 1.2):
+  """compare wall times to a baseline
+
+  :param threshold: ratio of wall times above which a case is a regression
+  :type threshold: float
+  :returns: list of (case, ratio, regression flag) for cases in both
+  """
+  base = dict((r['case'], r) for r in baseline if 'error' not in r)
+  return [
+    (r['case'], r['wall'] / base[r['case']]['wall'],
+     r['wall'] / base[r['case']]['wall'] > threshold)
+    for r in results if 'error' not in r and r['case'] in base
+  ]
+
+def report(results, comparison = None):
+  """print a results table (and comparison to baseline)"""
+  ratios = dict((c, (ratio, bad)) for c, ratio, bad in comparison or [])
+  for r in results:
+    if 'error' in r:
+      print '%-22s failed: %s' % (r['case'], r['error'])
+      continue
+    line = '%-22s %9.3fs %12.0f pts/s %8.1fMB %8.1fMB' % (
+      r['case'], r['wall'], r['throughput'], r['maxrss'], r['child_maxrss']
+    )
+    if r['case'] in ratios:
+      ratio, bad = ratios[r['case']]
+      line += ' %6.2fx%s' % (ratio, ' REGRESSION' if bad else '')
+    print line
+    print ' ' * 4 + ', '.join(
+      '%s %.3fs' % kv for kv in sorted(r['stages'].items())
+    )
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description = 'ccsgp benchmarks')
+  parser.add_argument('--sizes', type = int, nargs = '+', default = range(2, 8),
+                      help = 'exponents of the number of points')
+  parser.add_argument('--panels', nargs = '+', default = ['1x1', '2x2', '4x4', '8x8'],
+                      help = 'panel layouts')
+  parser.add_argument('--panel-points', type = int, default = 1000,
+                      help = 'number of points per subplot')
+  parser.add_argument('--no-convert', action = 'store_true',
+                      help = 'skip gs/convert, i.e. measure gnuplot only')
+  parser.add_argument('--save', help = 'save results to json file')
+  parser.add_argument('--baseline', help = 'compare to results saved before')
+  parser.add_argument('--threshold', type = float, default = 1.2,
+                      help = 'wall time ratio flagged as regression')
+  args = parser.parse_args()
+  results = run(cases(
+    args.sizes, args.panels, args.panel_points, not args.no_convert
+  ))
+  comparison = None
+  if args.baseline:
+    with open(args.baseline) as f:
+      comparison = compare(results, json.load(f), args.threshold)
+  report(results, comparison)
+  if args.save:
+    with open(args.save, 'w') as f: json.dump(results, f, indent = 2)
+  if comparison and any(bad for c, ratio, bad in comparison): sys.exit(1)
@@ -0,0 +1,180 @@
+"""
+compile-only mode: record plots as self-contained script bundles and render
+them later in bulk, e.g. on dedicated render hosts
+
+a bundle ``<name>.gpb`` is a directory containing
+
+* ``plot.gp``: the full gnuplot command stream of the plot
+* ``d<N>.bin``: binary data files referenced by plot.gp
+* ``data.npz``: datasets for hdf5/ascii output
+* ``manifest.json``: hardcopies to post-process and the directory relative to
+  the bundle in which the plot was compiled (output paths are relative to it)
+
+the bundle is complete after each hardcopy, repeated plots (see
+ccsgp.repeat_plot) append their commands and hardcopies to it
+
+render bundles w/ ``render_bundles`` or from the command line::
+
+  python bundle.py [-j <workers>] <bundle> [<bundle> ...]
+"""
+
+import os, json, tempfile, traceback
+import numpy as np
+from subprocess import call
+from multiprocessing import Pool, cpu_count
+import postproc
+
+class ScriptSession(object):
+  """stand-in for a Gnuplot.Gnuplot session writing commands into a bundle
+
+  :param path: bundle directory
+  :type path: str
+  :param debug: unused, for compatibility w/ Gnuplot.Gnuplot
+  :type debug: bool
+  """
+  def __init__(self, path, debug = 0):
+    if not os.path.exists(path): os.makedirs(path)
+    self.path = path
+    self.debug = debug
+    self.root = os.path.relpath(os.getcwd(), os.path.abspath(path))
+    self.hardcopies = []
+    self.itemlist = []
+    self.plotcmd = 'plot'
+    self.nfiles = 0
+    self._script = open(os.path.join(path, 'plot.gp'), 'w')
+    self.write = self._script.write
+    self.flush = self._script.flush
+    self.gnuplot = self # the "pipe" plot items write inline data into
+
+  def __call__(self, s):
+    self.gnuplot.write(s + '\n')
+
+  def plot(self, *items):
+    self.plotcmd = 'plot'
+    self.itemlist = list(items)
+    self.refresh()
+
+  def splot(self, *items):
+    self.plotcmd = 'splot'
+    self.itemlist = list(items)
+    self.refresh()
+
+  def refresh(self):
+    cmds = [ item.command() for item in self.itemlist ]
+    self(self.plotcmd + ' ' + ', '.join(filter(None, cmds)))
+    for item in self.itemlist: item.pipein(self.gnuplot)
+
+  def datafile(self):
+    """path of a new binary data file in the bundle"""
+    self.nfiles += 1
+    return os.path.join(self.path, 'd%d.bin' % (self.nfiles - 1))
+
+  def add_hardcopy(self, hardcopy, dataSets):
+    """record a hardcopy (see postproc.hardcopy) and the plot's datasets
+
+    the script is flushed, i.e. the bundle can be rendered right away
+    """
+    self._script.flush()
+    self.hardcopies.append(hardcopy)
+    keys = sorted(dataSets)
+    if len(self.hardcopies) == 1: # repeated plots share the datasets
+      np.savez(
+        os.path.join(self.path, 'data.npz'), *[ dataSets[k] for k in keys ]
+      )
+    with open(os.path.join(self.path, 'manifest.json'), 'w') as f:
+      json.dump({
+        'root': self.root, 'keys': keys, 'hardcopies': self.hardcopies
+      }, f, indent = 2)
+
+  def close(self):
+    self._script.close()
+
+def _load(bundle):
+  """manifest and datasets of a bundle"""
+  with open(os.path.join(bundle, 'manifest.json')) as f:
+    manifest = json.load(f)
+  npz = np.load(os.path.join(bundle, 'data.npz'))
+  dataSets = dict(
+    (k, npz['arr_%d' % i]) for i, k in enumerate(manifest['keys'])
+  )
+  return manifest, dataSets
+
+def _render_chunk(bundles):
+  """run the scripts of several bundles in one gnuplot process and
+  post-process their hardcopies
+
+  if gnuplot fails, the bundles are rendered one by one to isolate the error
+
+  :returns: list of (bundle, error)
+  """
+  lines = []
+  for b in bundles:
+    with open(os.path.join(b, 'manifest.json')) as f:
+      root = json.load(f)['root']
+    lines += [
+      'cd "%s"' % os.path.abspath(os.path.join(b, root)),
+      'load "%s"' % os.path.abspath(os.path.join(b, 'plot.gp')),
+      'unset multiplot', 'set output', 'reset'
+    ]
+  fd, driver = tempfile.mkstemp(suffix = '.gp', prefix = 'ccsgp_')
+  with os.fdopen(fd, 'w') as f: f.write('\n'.join(lines) + '\n')
+  env = dict(os.environ, GNUPLOT_PS_DIR = os.path.dirname(os.path.abspath(__file__)))
+  try: status = call(['gnuplot', driver], env = env)
+  finally: os.remove(driver)
+  if status != 0:
+    if len(bundles) > 1:
+      return [ r for b in bundles for r in _render_chunk([b]) ]
+    return [ (bundles[0], 'gnuplot exited with status %d' % status) ]
+  results = []
+  for b in bundles:
+    try:
+      manifest, dataSets = _load(b)
+      cwd = os.path.join(b, manifest['root'])
+      for h in manifest['hardcopies']:
+        h = dict((str(k), v) for k, v in h.iteritems())
+        for k in ['name', 'epsname', 'hdf5_store']:
+          if h.get(k) is not None: h[k] = os.path.join(cwd, h[k])
+        postproc.hardcopy(dataSets = dataSets, **h).wait()
+      postproc.wait_exports()
+      results.append((b, None))
+    except Exception:
+      results.append((b, traceback.format_exc()))
+  return results
+
+def render_bundles(bundles, workers = None, chunksize = 50):
+  """render bundles in bulk
+
+  * each worker process renders up to ``chunksize`` bundles per gnuplot
+    process, chunks are made smaller to keep all workers busy
+  * results are returned in input order
+
+  :param bundles: paths of bundle directories
+  :type bundles: list
+  :param workers: number of worker processes, defaults to number of cores
+  :type workers: int
+  :param chunksize: number of bundles rendered per gnuplot process
+  :type chunksize: int
+  :returns: list of ``(bundle, error)`` tuples, error is None on success
+  """
+  if workers is None: workers = cpu_count()
+  chunksize = max(1, min(chunksize, -(-len(bundles) // workers)))
+  chunks = [
+    bundles[i:i+chunksize] for i in xrange(0, len(bundles), chunksize)
+  ]
+  if workers < 2 or len(chunks) < 2:
+    return [ r for c in chunks for r in _render_chunk(c) ]
+  pool = Pool(min(workers, len(chunks)))
+  try:
+    return [ r for rs in pool.map(_render_chunk, chunks, 1) for r in rs ]
+  finally:
+    pool.close()
+    pool.join()
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description = 'render ccsgp bundles')
+  parser.add_argument('bundles', nargs = '+', help = 'bundle directories')
+  parser.add_argument('-j', '--workers', type = int, help = 'worker processes')
+  args = parser.parse_args()
+  for b, err in render_bundles(args.bundles, workers = args.workers):
+    if err is not None: print b, 'failed:\n', err
@@ -0,0 +1,199 @@
+"""
+content-addressed render cache to skip figures whose inputs didn't change
+
+* the key is a hash of all input arrays, properties, titles, keyword
+  arguments and the ccsgp source code (as version)
+* the outputs' basename ``name`` is keyed as absolute path, i.e. identical
+  plots in different directories have different keys
+* each successful render stores a copy of its output files in the store
+  under its key if all of them were written, the store is bounded in size
+  w/ LRU eviction
+* a lookup hits if the outputs recorded for the key still exist unchanged
+  (size and modification time), otherwise they are restored from the store
+  if possible
+
+:var render_cache: module-wide cache used by make_plot/make_panel
+"""
+
+import os, glob, json, shutil, hashlib, threading
+import numpy as np
+from collections import OrderedDict
+from config import cache_dir, cache_size
+from lazy import is_lazy, chunks
+
+_ignored_kwargs = ['wait', 'debug', 'cache'] # don't affect outputs
+_version = []
+
+def version():
+  """hash of the ccsgp sources used as version in cache keys"""
+  if not _version:
+    h = hashlib.sha1()
+    pkgdir = os.path.dirname(os.path.abspath(__file__))
+    for f in sorted(glob.glob(os.path.join(pkgdir, '*.py')) + [
+      os.path.join(pkgdir, 'prologue.ps')
+    ]):
+      with open(f, 'rb') as fh: h.update(fh.read())
+    _version.append(h.hexdigest())
+  return _version[0]
+
+def _update(h, obj):
+  """recursively feed a (nested) input object into hash ``h``"""
+  if is_lazy(obj): # out-of-core, hashed chunk by chunk
+    h.update('%s%s' % (obj.dtype.str, obj.shape))
+    for c in chunks(obj): h.update(np.ascontiguousarray(c).data)
+  elif isinstance(obj, np.ndarray):
+    h.update('%s%s' % (obj.dtype.str, obj.shape))
+    h.update(np.ascontiguousarray(obj).data)
+  elif isinstance(obj, dict):
+    items = obj.items() if isinstance(obj, OrderedDict) else sorted(obj.items())
+    h.update('{')
+    for k, v in items: _update(h, k); _update(h, v)
+    h.update('}')
+  elif isinstance(obj, (list, tuple)):
+    h.update('[')
+    for v in obj: _update(h, v)
+    h.update(']')
+  else:
+    h.update(repr(obj))
+
+def _stat(f):
+  """[size, mtime] of file ``f`` or None if it doesn't exist"""
+  try: st = os.stat(f)
+  except OSError: return None
+  return [st.st_size, st.st_mtime]
+
+def _unchanged(f, size, mtime):
+  """whether file ``f`` exists w/ given size and modification time"""
+  st = _stat(f)
+  return st is not None and st[0] == size and abs(st[1] - mtime) < 1e-3
+
+class RenderCache(object):
+  """size-bounded store of rendered outputs keyed by input hash
+
+  :param path: store directory
+  :type path: str
+  :param maxsize: maximum store size in bytes
+  :type maxsize: int
+  :ivar hits: number of lookups served from existing or restored outputs
+  :ivar misses: number of lookups which require rendering
+  :ivar restores: number of hits which restored outputs from the store
+  :ivar evictions: number of entries evicted from the store
+  :ivar last_hit: output files of the last hit
+  """
+  def __init__(self, path = cache_dir, maxsize = cache_size):
+    self.path = path
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.restores = 0
+    self.last_hit = None
+    self.evictions = 0
+    self._index = None # key -> [size, atime], loaded lazily
+    self._lock = threading.Lock()
+
+  def key(self, *args, **kwargs):
+    """hash of positional inputs and keyword arguments
+
+    ``name`` (if given) is resolved to an absolute path as the outputs are
+    recorded w/ absolute paths
+    """
+    if 'name' in kwargs: kwargs['name'] = os.path.abspath(kwargs['name'])
+    h = hashlib.sha1(version())
+    _update(h, args)
+    _update(h, dict(
+      (k, v) for k, v in kwargs.iteritems() if k not in _ignored_kwargs
+    ))
+    return h.hexdigest()
+
+  def _entry(self, key):
+    return os.path.join(self.path, key)
+
+  def _load_index(self):
+    """scan the store once per process"""
+    if self._index is not None: return
+    self._index = {}
+    if not os.path.isdir(self.path): return
+    for key in os.listdir(self.path):
+      meta = os.path.join(self._entry(key), 'meta.json')
+      if not os.path.exists(meta): continue
+      with open(meta) as f: size = json.load(f)['size']
+      self._index[key] = [size, os.path.getmtime(meta)]
+
+  def lookup(self, key):
+    """check whether the outputs for ``key`` exist or can be restored
+
+    :returns: True on hit
+    """
+    meta = os.path.join(self._entry(key), 'meta.json')
+    try:
+      with open(meta) as f: files = json.load(f)['files']
+    except (IOError, OSError, ValueError):
+      self.misses += 1
+      return False
+    if not all(_unchanged(f, size, mtime) for f, size, mtime in files):
+      try:
+        for f, size, mtime in files:
+          shutil.copy2(os.path.join(self._entry(key), os.path.basename(f)), f)
+      except (IOError, OSError):
+        self.misses += 1
+        return False
+      self.restores += 1
+    os.utime(meta, None) # LRU
+    with self._lock:
+      if self._index is not None and key in self._index:
+        self._index[key][1] = os.path.getmtime(meta)
+    self.hits += 1
+    self.last_hit = [ f for f, size, mtime in files ]
+    return True
+
+  def store(self, key, files):
+    """copy rendered output files into the store and evict LRU entries
+
+    :param key: cache key
+    :type key: str
+    :param files: output files, nothing is stored if one of them is missing
+      (e.g. failed conversion) such that later lookups miss
+    :type files: list
+    """
+    stats = [ _stat(f) for f in files ]
+    entry = self._entry(key)
+    if os.path.exists(entry): shutil.rmtree(entry, ignore_errors = True)
+    if None in stats: return
+    files = [ [os.path.abspath(f)] + st for f, st in zip(files, stats) ]
+    os.makedirs(entry)
+    for f, size, mtime in files:
+      shutil.copy2(f, os.path.join(entry, os.path.basename(f)))
+    size = sum(f[1] for f in files)
+    with open(os.path.join(entry, 'meta.json'), 'w') as fh:
+      json.dump({'files': files, 'size': size}, fh)
+    with self._lock:
+      self._load_index()
+      self._index[key] = [size, os.path.getmtime(os.path.join(entry, 'meta.json'))]
+      total = sum(s for s, t in self._index.itervalues())
+      for k, (s, t) in sorted(self._index.items(), key = lambda i: i[1][1]):
+        if total <= self.maxsize or k == key: continue
+        shutil.rmtree(self._entry(k), ignore_errors = True)
+        del self._index[k]
+        total -= s
+        self.evictions += 1
+
+  def clear(self):
+    """remove all entries from the store"""
+    with self._lock:
+      shutil.rmtree(self.path, ignore_errors = True)
+      self._index = {}
+
+  def stats(self):
+    """hit/miss counters and store size
+
+    :returns: dict w/ hits, misses, restores, evictions, entries and size
+    """
+    with self._lock:
+      self._load_index()
+      return {
+        'hits': self.hits, 'misses': self.misses, 'restores': self.restores,
+        'evictions': self.evictions, 'entries': len(self._index),
+        'size': sum(s for s, t in self._index.itervalues())
+      }
+
+render_cache = RenderCache()
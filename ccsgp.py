@@ -1,6 +1,15 @@
+import os, traceback
 import numpy as np
-from myplot import MyPlot
-from config import ureg, default_size
+from collections import deque
+from multiprocessing import Pool, cpu_count, current_process
+from myplot import MyPlot, is_map, map_datasets
+from stream import StreamPlot
+from pool import gnuplot_pool
+from gsbatch import gs_batch
+from cache import render_cache
+import postproc, timing
+from utils import size_dims, convert_length
+from config import default_size, hdf5_store
 
 def make_plot(data, properties, titles, **kwargs):
   """ main function to generate a 1D plot
@@ -65,39 +74,234 @@ def make_plot(data, properties, titles, **kwargs):
   :type arrow_bar: float
   :param gpcalls: execute arbitrary gnuplot set commands
   :type gpcalls: list
-  :returns: MyPlot
+  :param backend: 'ps' (default, see config) or 'cairo' for direct
+    pdf/png/svg output without gs/convert
+  :type backend: str
+  :param transfer: 'text', 'binary' or 'inline' data transfer to gnuplot
+    (default see config)
+  :type transfer: str
+  :param decimate: reduce plotted data to the output resolution w/ 'minmax'
+    or 'lttb' (x-sorted data), hdf5/ascii output keeps all data points
+  :type decimate: str
+  :param compile_only: only write the gnuplot script and data into the bundle
+    ``<name>.gpb`` and render it later via bundle.render_bundles, the bundle
+    is complete when make_plot returns, repeat_plot/repeat_plots add their
+    variants to it until the plot is closed
+  :type compile_only: bool
+  :param cache: skip rendering if the outputs for identical inputs exist or
+    can be restored from the render cache (see cache.py)
+  :type cache: bool
+  :param hdf5_store: write data into group ``name`` of this shared hdf5 file
+    (chunked, compressed, safe for make_plots) instead of ``name.hdf5``
+  :type hdf5_store: str
+  :param hdf5_mode: 'overwrite' (default) or 'append' the group in hdf5_store
+  :type hdf5_mode: str
+  :param export_format: data export as 'dat' (ascii, default), 'npy' or 'npz'
+    files, None to disable
+  :type export_format: str
+  :param export_precision: digits after the decimal point for 'dat' export
+  :type export_precision: int
+  :param export_background: write data export in a background thread which
+    isn't waited for (see postproc.wait_exports)
+  :type export_background: bool
+  :param wait: block until all output files are written, otherwise
+    conversion and data export continue in the background (see
+    ``MyPlot.postprocess``)
+  :type wait: bool
+  :returns: MyPlot (call its ``close`` to hand the gnuplot session back to
+    the pool early, otherwise this happens when it is garbage collected),
+    None if served from the render cache
   """
+  use_cache = kwargs.get('cache') and not kwargs.get('compile_only')
+  if use_cache:
+    key = render_cache.key(data, properties, titles, **_cache_kwargs(kwargs))
+    if render_cache.lookup(key): return None
   plt = MyPlot(
     name = kwargs.get('name', 'test'),
     title = kwargs.get('title', ''),
-    debug = kwargs.get('debug', 0)
+    debug = kwargs.get('debug', 0),
+    backend = kwargs.get('backend'),
+    transfer = kwargs.get('transfer'),
+    bundle = kwargs.get('name', 'test') + '.gpb'
+    if kwargs.get('compile_only') else None
   )
+  plt.kwargs = kwargs
+  plt.size = kwargs.get('size', default_size)
+  plt.setDecimation(kwargs.get('decimate'), xrange = kwargs.get('xr'))
   plt.setErrorArrows(**kwargs)
+  plt.setExport(**kwargs)
   plt.setAxisLogs(**kwargs)
   plt.initData(data, properties, titles)
   plt.prepare_plot(**kwargs)
   plt._setter(kwargs.get('gpcalls', []))
-  plt.plot()
+  postprocess = plt.plot(wait = False)
+  if use_cache: postprocess.then(render_cache.store, (key, plt.outputs()))
+  if postprocess is not None and kwargs.get('wait', True): postprocess.wait()
   return plt
 
+def make_map(z, xedges, yedges, **kwargs):
+  """ main function to generate a 2D map (heatmap)
+
+  * z[i, j] is the value of the bin [xedges[j], xedges[j+1]] x [yedges[i],
+    yedges[i+1]], e.g. ``np.histogram2d(x, y, ...)[0].T``, also out-of-core
+    (see lazy.py)
+  * the matrix is sent to gnuplot in binary format, drawn w/ gnuplot's
+    image style for equidistant bins on linear axes and pm3d otherwise
+  * x/y-axis ranges default to the outer bin edges
+  * z, xedges and yedges are exported as ``map``, ``map_xedges`` and
+    ``map_yedges`` (hdf5/ascii)
+  * all other options see make_plot (w/o decimate/arrow options)
+
+  :param z: values of the bins
+  :type z: numpy.array (2D)
+  :param xedges: bin edges along x
+  :type xedges: numpy.array
+  :param yedges: bin edges along y
+  :type yedges: numpy.array
+
+  :param zlabel: label of the color box
+  :type zlabel: str
+  :param zr: range of the color axis
+  :type zr: list
+  :param zlog: logarithmic color axis
+  :type zlog: bool
+  :param palette: gnuplot palette specification (default see config)
+  :type palette: str
+  :param map_style: force 'image' or 'pm3d'
+  :type map_style: str
+  :returns: MyPlot, None if served from the render cache
+  """
+  use_cache = kwargs.get('cache') and not kwargs.get('compile_only')
+  if use_cache:
+    key = render_cache.key('map', z, xedges, yedges, **_cache_kwargs(kwargs))
+    if render_cache.lookup(key): return None
+  plt = MyPlot(
+    name = kwargs.get('name', 'test'),
+    title = kwargs.get('title', ''),
+    debug = kwargs.get('debug', 0),
+    backend = kwargs.get('backend'),
+    transfer = kwargs.get('transfer'),
+    bundle = kwargs.get('name', 'test') + '.gpb'
+    if kwargs.get('compile_only') else None
+  )
+  plt.kwargs = kwargs
+  plt.size = kwargs.get('size', default_size)
+  plt.setExport(**kwargs)
+  plt.setAxisLogs(**kwargs)
+  plt.setColorbox(**kwargs)
+  plt.initMap(z, xedges, yedges, style = kwargs.get('map_style'))
+  plt.prepare_plot(**_map_options(xedges, yedges, kwargs))
+  plt._setter(kwargs.get('gpcalls', []))
+  postprocess = plt.plot(wait = False)
+  if use_cache: postprocess.then(render_cache.store, (key, plt.outputs()))
+  if postprocess is not None and kwargs.get('wait', True): postprocess.wait()
+  return plt
+
+def _cache_kwargs(kwargs):
+  """keyword arguments for the render cache key incl. the default name"""
+  return dict(kwargs, name = kwargs.get('name', 'test'))
+
+def _map_options(xedges, yedges, kwargs):
+  """options w/ axis ranges of a map defaulting to its outer bin edges"""
+  opts = dict(kwargs)
+  for axis, edges in [('x', xedges), ('y', yedges)]:
+    if opts.get(axis + 'r') is None: opts[axis + 'r'] = [edges[0], edges[-1]]
+  return opts
+
 def repeat_plot(plt, name, **kwargs):
   """repeat a plot with different properties (kwargs see make_plot)
 
+  * plots made w/ ``compile_only`` record the repetition into their bundle,
+    ``compile_only`` requires such a plot
+
   :param plt: plot to repeat
   :type plt: MyPlot
   :param name: basename of new output file(s)
   :type name: str
   :returns: plt
   """
+  _check_compile_only(plt, kwargs)
   plt.gp('set terminal dumb')
-  plt.epsname = name + '.eps'
+  plt.name, plt.epsname = name, name + '.eps'
+  plt.timer.name = name
   plt.setErrorArrows(**kwargs)
+  plt.setExport(**kwargs)
   plt.setAxisLogs(**kwargs)
+  plt.updateLayout()
   plt.prepare_plot(**kwargs)
   plt._setter(kwargs.get('gpcalls', []))
-  plt.plot()
+  plt.plot(wait = kwargs.get('wait', True))
   return plt
 
+def repeat_plots(plt, variants, wait = True):
+  """render several variants of a plot w/o sending its data again
+
+  * each variant is a dict of options (xr/yr/xlog/ylog/lines/labels/name
+    ...) which override the make_plot options ``plt`` was created with,
+    ``name`` sets the basename of the variant's output files
+  * labels, arrows and lines of the plot/previous variant are removed
+    before the next variant draws its own (the make_plot options unless
+    overridden)
+  * the data stays uploaded in the plot's gnuplot session (text/binary
+    transfer), only the plot command is repeated for each variant
+  * limit arrows, using specs and autoscaling of variants changing
+    xlog/ylog are recomputed (see MyPlot.updateLayout)
+
+  * variants of plots made w/ ``compile_only`` are recorded into their
+    bundle (see repeat_plot), their handles are None
+
+  :param plt: plot returned by make_plot
+  :type plt: MyPlot
+  :param variants: option overrides for each variant
+  :type variants: list of dict
+  :param wait: block until all output files are written
+  :type wait: bool
+  :returns: list of postproc.PostProcess handles (one per variant)
+  """
+  for variant in variants: _check_compile_only(plt, variant)
+  handles = []
+  for variant in variants:
+    opts = dict(getattr(plt, 'kwargs', {}), **variant)
+    plt.resetOverlays()
+    plt.gp('set terminal dumb')
+    name = opts.get('name', plt.name)
+    plt.name, plt.epsname = name, name + '.eps'
+    plt.timer.name = name
+    plt.setErrorArrows(**opts)
+    plt.setExport(**opts)
+    plt.setAxisLogs(**opts)
+    plt.updateLayout()
+    plt.data = deque(plt._base_data) # lines are added by prepare_plot
+    plt.prepare_plot(**opts)
+    plt._setter(opts.get('gpcalls', []))
+    handles.append(plt.plot(wait = False))
+  if wait:
+    for h in handles:
+      if h is not None: h.wait()
+  return handles
+
+def _check_compile_only(plt, kwargs):
+  """raise if a repetition w/ ``compile_only`` can't go into a bundle"""
+  if plt.gp is None: raise ValueError('plot was closed already')
+  if kwargs.get('compile_only') and plt.bundle is None:
+    raise ValueError('compile_only requires a plot made w/ compile_only')
+
+def make_stream(properties, titles, **kwargs):
+  """start a live plot whose datasets are appended to over time
+
+  * options see make_plot and stream.StreamPlot (max_rate,
+    hardcopy_interval, window, max_points, terminal)
+  * ``plt.append(i, chunk)`` adds data points to the i-th dataset,
+    ``plt.hardcopy()`` writes the output files of the current data
+
+  :param properties: gnuplot property strings for each dataset
+  :type properties: list
+  :param titles: legend/key titles for each dataset
+  :type titles: list
+  :returns: stream.StreamPlot
+  """
+  return StreamPlot(properties, titles, **kwargs)
+
 def make_panel(dpt_dict, **kwargs):
   """make a panel plot
 
@@ -111,45 +315,53 @@ def make_panel(dpt_dict, **kwargs):
     ``data/properties/titles`` as values, see below
   * ``layout`` = '<cols>x<rows>', defaults to horizontal panel if omitted
   * ``key_subplot_id`` sets the desired subplot to put the key in
+  * ``tiles``: render each subplot as cached transparent png tile and
+    composite the tiles into png/pdf/jpg, i.e. only changed subplots are
+    re-rendered (raster output, see _tiled_panel)
+  * subplots can be 2D maps given as ``[z, xedges, yedges]`` instead (see
+    make_map, incl. its color box options), their axis ranges default to
+    the outer bin edges
 
-  :param dpt_dict: ``OrderedDict('subplot-title': [data, properties, titles], ...)``
+  :param dpt_dict: ``OrderedDict('subplot-title': [data, properties, titles]
+    or [z, xedges, yedges], ...)``
   :type dpt_dict: dict
+  :param tiles: tile-based incremental rendering
+  :type tiles: bool
+  :param workers: number of processes rendering tiles, defaults to number of
+    cores
+  :type workers: int
+  :returns: postproc.PostProcess handle of the hardcopy stages (see ``wait``
+    in make_plot), None if served from the render cache (see ``cache`` in
+    make_plot) or in compile-only mode
   """
-  plt = MyPlot(
-    name = kwargs.get('name', 'test'),
-    title = kwargs.get('title', ''),
-    debug = kwargs.get('debug', 0)
-  )
+  use_cache = kwargs.get('cache') and not kwargs.get('compile_only')
+  if use_cache:
+    key = render_cache.key(dpt_dict, **_cache_kwargs(kwargs))
+    if render_cache.lookup(key): return None
   nSubPlots = len(dpt_dict)
-  plt.size = kwargs.get('size', default_size)
-  height, width = [
-      float(ureg.parse_expression(s).to('cm').magnitude)
-      for s in plt.size.split(',')
-  ]
-  text_inch = ureg.parse_expression('24point').to('cm').magnitude
+  size = kwargs.get('size', default_size)
+  width, height = size_dims(size, 'cm')
+  text_inch = convert_length('24point', 'cm')
   lm = kwargs.get('lmargin', 2.2*text_inch/width)
   bm = kwargs.get('bmargin', 1.8*text_inch/height)
   rm = kwargs.get('rmargin', 0.99)
   tm = kwargs.get('tmargin', 0.99)
   xlabel, ylabel = kwargs.get('xlabel',''), kwargs.get('ylabel','')
-  plt._setter([
-    'label 100 "%s" at screen %f,%f rotate center' % (ylabel, lm/2/2.2, (bm+tm)/2),
-    'label 101 "%s" at screen %f,%f center' % (xlabel, (lm+rm)/2, bm/2/1.8),
-  ])
   nx, ny = nSubPlots, 1 # horizontal panel by default
   layout = kwargs.get('layout')
   if layout is not None: nx, ny = map(int, layout.split('x'))
-  w, h = (rm - lm) / nx, (tm - bm) / ny
-  nDanglPlots = nSubPlots%nx # number of plots "dangling" in last row
-  plt._setter([
-    'terminal postscript eps enhanced color "Helvetica" 24 size %fcm,%fcm' % (width, height),
-    'output "%s"' % plt.epsname,
-    'multiplot layout %d,%d rowsfirst' % (ny, nx)
-  ])
-  plt.setErrorArrows(**kwargs)
-  xgap, ygap = 0.1 / width, 0.1 / height # both in cm
-  key_subplot_id = kwargs.get('key_subplot_id', 0)
-  if nDanglPlots > 0 and key_subplot_id > len(dpt_dict)-1: # allow for key in dangling panel
+  grid = dict(
+    frame = [
+      'label 100 "%s" at screen %f,%f rotate center' % (ylabel, lm/2/2.2, (bm+tm)/2),
+      'label 101 "%s" at screen %f,%f center' % (xlabel, (lm+rm)/2, bm/2/1.8),
+    ],
+    nx = nx, ny = ny, lm = lm, tm = tm,
+    w = (rm - lm) / nx, h = (tm - bm) / ny,
+    nDanglPlots = nSubPlots%nx, # number of plots "dangling" in last row
+    xgap = 0.1 / width, ygap = 0.1 / height, # both in cm
+    key_subplot_id = kwargs.get('key_subplot_id', 0)
+  )
+  if grid['nDanglPlots'] > 0 and grid['key_subplot_id'] > len(dpt_dict)-1: # allow for key in dangling panel
       cp_key = dpt_dict.keys()[0]
       xr = kwargs.get('xr') 
       if xr is not None: xfake = xr[0] - 0.5 * (xr[1]-xr[0])
@@ -158,38 +370,282 @@ def make_panel(dpt_dict, **kwargs):
           [ np.array([[xfake, 1, 0, 0, 0]]) for d in dpt_dict[cp_key][0] ],
           dpt_dict[cp_key][1], dpt_dict[cp_key][2]
       ]})
-  for subplot_title, dpt in dpt_dict.iteritems():
-    if plt.nLabels > 0: plt.gp('unset label')
-    plt.setLabel('{/Helvetica-Bold %s}' % subplot_title, [0.1, 0.9])
-    plt.setAxisLogs(**kwargs)
-    plt.initData(*dpt, subplot_title = subplot_title)
-    plt.prepare_plot(margins=False, **kwargs)
-    col, row = plt.nPanels % nx, plt.nPanels / nx
-    sub_lm = lm + col * w + xgap/2.
-    sub_rm = lm + (col + 1) * w - xgap/2.
-    sub_tm = tm - row * h - ygap/2.
-    sub_bm = tm - (row + 1) * h + ygap/2.
-    plt.gp('unset xlabel')
-    plt.gp('unset ylabel')
-    if col > 0: plt.gp('set format y " "')
-    if ( row < ny-1 and not nDanglPlots ) or (
-        row+1 == ny-1 and nDanglPlots and col+1 <= nDanglPlots
-    ): plt.gp('set format x " "')
-    if plt.nPanels > 0:
-      plt.gp('set noarrow')
-    if plt.nPanels != key_subplot_id:
-      plt.gp('unset key')
-    plt.nPanels += 1
-    plt._setter([
-      'lmargin at screen %f' % sub_lm, 'rmargin at screen %f' % sub_rm,
-      'bmargin at screen %f' % sub_bm, 'tmargin at screen %f' % sub_tm
-    ] + kwargs.get('gpcalls', []))
-    if nDanglPlots > 0 and plt.nPanels-1 == key_subplot_id:
-      plt.gp('set format x " "')
-      plt.gp('unset border')
-      plt.gp('unset xtics')
-      plt.gp('unset ytics')
-      plt.gp('unset object')
+  if kwargs.get('tiles') and not kwargs.get('compile_only'):
+    postprocess = _tiled_panel(dpt_dict, grid, **kwargs)
+    if use_cache:
+      postprocess.then(render_cache.store, (key, list(postprocess.files)))
+    if kwargs.get('wait', True): postprocess.wait()
+    return postprocess
+  plt = MyPlot(
+    name = kwargs.get('name', 'test'),
+    title = kwargs.get('title', ''),
+    debug = kwargs.get('debug', 0),
+    backend = kwargs.get('backend'),
+    transfer = kwargs.get('transfer'),
+    bundle = kwargs.get('name', 'test') + '.gpb'
+    if kwargs.get('compile_only') else None
+  )
+  plt.size = size
+  plt._setter(grid['frame'])
+  plt.setDecimation(kwargs.get('decimate'), nx, kwargs.get('xr'))
+  plt._setter([
+    plt._terminal('eps' if plt.backend == 'ps' else 'pdf'),
+    'output "%s"' % (plt.epsname if plt.backend == 'ps' else plt.name + '.pdf'),
+    'multiplot layout %d,%d rowsfirst' % (ny, nx)
+  ])
+  plt.setErrorArrows(**kwargs)
+  plt.setExport(**kwargs)
+  for i, (subplot_title, dpt) in enumerate(dpt_dict.iteritems()):
+    _draw_subplot(plt, i, subplot_title, dpt, grid, **kwargs)
     plt.plot(hardcopy = False)
-  plt._hardcopy()
   plt.gp('unset multiplot; set output')
+  postprocess = plt._hardcopy(wait = False)
+  if use_cache: postprocess.then(render_cache.store, (key, plt.outputs()))
+  plt.close()
+  if postprocess is not None and kwargs.get('wait', True): postprocess.wait()
+  return postprocess
+
+def _draw_subplot(plt, index, subplot_title, dpt, grid, **kwargs):
+  """set up the ``index``-th subplot of a panel in its screen box
+
+  :param grid: panel geometry determined in make_panel
+  :type grid: dict
+  """
+  nx, ny, nDanglPlots = grid['nx'], grid['ny'], grid['nDanglPlots']
+  if plt.nLabels > 0: plt.gp('unset label')
+  plt.setLabel('{/Helvetica-Bold %s}' % subplot_title, [0.1, 0.9])
+  plt.setAxisLogs(**kwargs)
+  if is_map(dpt):
+    plt.setColorbox(**kwargs)
+    plt.initMap(*dpt, subplot_title = subplot_title, style = kwargs.get('map_style'))
+    kwargs = _map_options(dpt[1], dpt[2], kwargs)
+  else:
+    plt.initData(*dpt, subplot_title = subplot_title)
+  plt.prepare_plot(margins=False, **kwargs)
+  col, row = index % nx, index / nx
+  sub_lm = grid['lm'] + col * grid['w'] + grid['xgap']/2.
+  sub_rm = grid['lm'] + (col + 1) * grid['w'] - grid['xgap']/2.
+  sub_tm = grid['tm'] - row * grid['h'] - grid['ygap']/2.
+  sub_bm = grid['tm'] - (row + 1) * grid['h'] + grid['ygap']/2.
+  plt.gp('unset xlabel')
+  plt.gp('unset ylabel')
+  if col > 0: plt.gp('set format y " "')
+  if ( row < ny-1 and not nDanglPlots ) or (
+      row+1 == ny-1 and nDanglPlots and col+1 <= nDanglPlots
+  ): plt.gp('set format x " "')
+  if index > 0:
+    plt.gp('set noarrow')
+  if index != grid['key_subplot_id']:
+    plt.gp('unset key')
+  plt.nPanels += 1
+  plt._setter([
+    'lmargin at screen %f' % sub_lm, 'rmargin at screen %f' % sub_rm,
+    'bmargin at screen %f' % sub_bm, 'tmargin at screen %f' % sub_tm
+  ] + kwargs.get('gpcalls', []))
+  if nDanglPlots > 0 and index == grid['key_subplot_id']:
+    plt.gp('set format x " "')
+    plt.gp('unset border')
+    plt.gp('unset xtics')
+    plt.gp('unset ytics')
+    plt.gp('unset object')
+
+_tile_ignored_kwargs = [ # options which don't change the pixels of a tile
+  'name', 'tiles', 'workers', 'cache', 'wait', 'compile_only', 'hdf5_store',
+  'hdf5_mode', 'export_format', 'export_precision', 'export_background'
+]
+
+def _tiled_panel(dpt_dict, grid, **kwargs):
+  """render a panel from subplot tiles cached in ``<cache_dir>/tiles``
+
+  * each subplot is drawn on a full-size transparent png (pngcairo) at its
+    position in the panel, the tile is keyed by the subplot's data and all
+    options changing its pixels, unchanged tiles are reused
+  * missing tiles are rendered in parallel (see make_plots), afterwards all
+    tiles are flattened into name.png and converted to pdf/jpg
+  * w/o ``xr``/``yr`` a subplot is autoscaled including the data of all
+    previous subplots (as in the multiplot), whose data then is part of the
+    tile's key
+  * the tile directory isn't bounded by cache_size, clear it via
+    ``render_cache.clear``
+
+  :returns: postproc.PostProcess
+  """
+  tiledir = os.path.join(render_cache.path, 'tiles')
+  if not os.path.isdir(tiledir): os.makedirs(tiledir)
+  opts = dict(
+    (k, v) for k, v in kwargs.iteritems() if k not in _tile_ignored_kwargs
+  )
+  autoscale = kwargs.get('xr') is None or kwargs.get('yr') is None
+  tiles, jobs, prior, dataSets = [], [], [], {}
+  for i, (subplot_title, dpt) in enumerate(dpt_dict.iteritems()):
+    context = list(prior) if autoscale else []
+    name = os.path.join(tiledir, render_cache.key(
+      'tile', i, subplot_title, dpt, context, grid, **opts
+    ))
+    tiles.append(name + '.png')
+    if not os.path.exists(name + '.png'):
+      jobs.append((dpt, i, subplot_title, grid, context, dict(opts, name = name)))
+    if is_map(dpt):
+      entries = map_datasets('_'.join([subplot_title, 'map']), *dpt)
+      if any(k in dataSets for k in entries):
+        raise ValueError("duplicate key '{0}'!".format(subplot_title))
+      dataSets.update(entries)
+      continue
+    prior += list(dpt[0])
+    for j, (k, v) in enumerate(zip(dpt[2], dpt[0])):
+      key = '_'.join([subplot_title, k if k else 'graph' + str(j)])
+      if key in dataSets: raise ValueError("duplicate key '{0}'!".format(k))
+      dataSets[key] = v
+  errors = [ err for n, err in _run_batch(
+    _make_tile, 5, jobs, kwargs.get('workers'), fail_fast = True
+  ) if err is not None ]
+  if errors: raise RuntimeError('tile rendering failed:\n' + errors[0])
+  timer = timing.StageTimer(kwargs.get('name', 'test'))
+  timer.records += timing.last_batch # stages of the rendered tiles
+  export = dict(
+    hdf5_store = hdf5_store, hdf5_mode = 'overwrite', export_format = 'dat',
+    export_precision = 4, export_background = False
+  )
+  export.update((k, kwargs[k]) for k in export.keys() if k in kwargs)
+  return postproc.tiled_hardcopy(
+    kwargs.get('name', 'test'), tiles, kwargs.get('size', default_size),
+    dataSets, timer = timer, **export
+  )
+
+def _make_tile(dpt, index, subplot_title, grid, context, **kwargs):
+  """render one subplot of a tiled panel into ``<name>.png``
+
+  gnuplot writes ``<name>.tmp`` and renames it when done, i.e. the tile only
+  exists once complete. The job waits for gnuplot and fails if the tile
+  wasn't written.
+
+  :param context: datasets of previous subplots included in autoscaling
+  :type context: list
+  :returns: MyPlot
+  """
+  plt = MyPlot(
+    name = kwargs['name'], title = kwargs.get('title', ''),
+    debug = kwargs.get('debug', 0), backend = 'cairo',
+    transfer = kwargs.get('transfer')
+  )
+  plt.size = kwargs.get('size', default_size)
+  if index == 0: plt._setter(grid['frame'])
+  plt.setDecimation(kwargs.get('decimate'), grid['nx'], kwargs.get('xr'))
+  plt.setErrorArrows(**kwargs)
+  plt.setAxisLogs(**kwargs)
+  for i, d in enumerate(context):
+    plt.dataStats['_context%d' % i] = plt._data_stats(d)
+  plt._setter([
+    plt._terminal('png', transparent = True), 'output "%s.tmp"' % plt.name
+  ])
+  _draw_subplot(plt, index, subplot_title, dpt, grid, **kwargs)
+  plt.plot(hardcopy = False)
+  plt.gp('set output')
+  plt.gp('system "mv -f %s.tmp %s.png"' % (plt.name, plt.name))
+  plt.gp.sync()
+  if not os.path.exists(plt.name + '.png'):
+    raise RuntimeError('gnuplot failed to render tile %s.png' % plt.name)
+  return plt
+
+def _detach_worker():
+  """drop gnuplot/gs processes and background writer state inherited from
+  the parent (pool initializer)"""
+  gnuplot_pool.detach()
+  gs_batch.detach()
+  postproc.background.detach()
+
+_batch = {} # function & jobs of the running batch, inherited by forked workers
+
+def _run_indexed(i):
+  """(i, result of the i-th job), see _run_job"""
+  return i, _run_job(i)
+
+def _run_job(i):
+  """run the i-th job of the current batch
+
+  :returns: (basename of output files, None, timing records) or (None,
+    formatted traceback, [])
+  """
+  func, nargs, job = _batch['func'], _batch['nargs'], _batch['jobs'][i]
+  args, kwargs = job[:nargs], job[nargs] if len(job) > nargs else {}
+  try:
+    plt = func(*args, **kwargs)
+    if isinstance(plt, MyPlot): plt.close()
+    postproc.wait_exports() # worker may exit before background exports
+    timer = getattr(plt, 'timer', None)
+    return kwargs.get('name', 'test'), None, timer.records if timer else []
+  except Exception:
+    return None, traceback.format_exc(), []
+
+def _run_batch(func, nargs, jobs, workers, fail_fast = False):
+  """run jobs through func on a pool of forked worker processes
+
+  * jobs are handed to the workers by index and the job list itself is
+    inherited via fork, i.e. numpy arrays are shared copy-on-write instead of
+    being pickled
+  * each worker keeps its own pool of gnuplot sessions
+  * results are collected as the jobs finish, w/ ``fail_fast`` the batch is
+    stopped at the first failing job
+  * the timing records of all jobs are collected in timing.last_batch
+
+  :param fail_fast: stop at the first error (remaining jobs are missing
+    from the results)
+  :type fail_fast: bool
+  :returns: list of ``(name, error)`` tuples in job order
+  """
+  if workers is None: workers = cpu_count()
+  if current_process().daemon: workers = 1 # no nested pools in workers
+  outer = dict(_batch) # e.g. tiles rendered within a make_panels job
+  _batch.clear()
+  _batch.update(func = func, nargs = nargs, jobs = jobs)
+  try:
+    done, failed = {}, False
+    if workers < 2 or len(jobs) < 2:
+      for i in xrange(len(jobs)):
+        done[i] = _run_job(i)
+        if fail_fast and done[i][1] is not None: break
+    else:
+      pool = Pool(min(workers, len(jobs)), initializer = _detach_worker)
+      try:
+        for i, r in pool.imap_unordered(_run_indexed, xrange(len(jobs))):
+          done[i] = r
+          if fail_fast and r[1] is not None:
+            failed = True
+            break
+      finally:
+        if failed: pool.terminate()
+        else: pool.close()
+        pool.join()
+    results = [ done[i] for i in sorted(done) ]
+    timing.last_batch = [ r for n, e, records in results for r in records ]
+    return [ (n, e) for n, e, records in results ]
+  finally:
+    _batch.clear()
+    _batch.update(outer)
+
+def make_plots(jobs, workers = None):
+  """render many plots in parallel (see make_plot)
+
+  * a job is a tuple ``(data, properties, titles, kwargs)``, kwargs optional
+  * a failing job does not stop the batch, its traceback is returned instead
+  * results are returned in input order, aggregated timing of all stages
+    see timing.batch_stats
+
+  :param jobs: make_plot arguments for each plot
+  :type jobs: list
+  :param workers: number of worker processes, defaults to number of cores
+  :type workers: int
+  :returns: list of ``(name, error)`` tuples, error is None on success
+  """
+  return _run_batch(make_plot, 3, jobs, workers)
+
+def make_panels(jobs, workers = None):
+  """render many panel plots in parallel (see make_panel and make_plots)
+
+  :param jobs: ``(dpt_dict, kwargs)`` tuples, kwargs optional
+  :type jobs: list
+  :param workers: number of worker processes, defaults to number of cores
+  :type workers: int
+  :returns: list of ``(name, error)`` tuples, error is None on success
+  """
+  return _run_batch(make_panel, 1, jobs, workers)
@@ -3,13 +3,82 @@
 :var basic_setup: bars, grid, terminal and default_key
 :var default_margins: default margins to define plot area
 :var xPanProps: xscale, xsize, xoffset for panel plots
+:var pool_size: maximum number of idle gnuplot sessions kept warm
+:var pool_timeout: seconds after which an idle gnuplot session is closed
+:var default_backend: 'ps' or 'cairo', see MyPlot
+:var cairo_formats: formats written directly by the cairo backend
+:var raster_density: resolution of raster output in dpi
+:var run_converters: convert hardcopies via gs/convert (off e.g. to benchmark
+  gnuplot alone)
+:var batch_converters: convert postscript hardcopies w/ long-lived gs
+  processes (see gsbatch.py) instead of one gs and two convert calls each,
+  png/jpg are then rendered by gs, gs runs w/o -dSAFER (opt-in)
+:var gs_workers: maximum number of gs processes per output device
+:var gs_threads: rendering threads of each gs process for png/jpg
+:var default_transfer: 'text', 'binary' or 'inline', see MyPlot
+:var transfer_dir: directory for binary data files (falls back to tempdir)
+:var hdf5_store: default shared hdf5 store for data export
+:var cache_dir: directory of the render cache store
+:var cache_size: maximum size of the render cache store in bytes
+:var chunk_rows: rows per chunk for out-of-core datasets (see lazy.py)
+:var timing_sink: JSON-lines file for stage timing records (see timing.py)
+:var map_palette: default gnuplot palette for 2D maps
+:var daemon_socket: Unix socket of the render daemon (see daemon.py)
+:var daemon_workers: worker processes of the render daemon (None = cores)
+:var daemon_queue: maximum number of waiting jobs per priority lane
 :var default_colors: provides a reasonable color selection (see palette_)
 
 .. _palette: http://colorbrewer2.org/
 """
 
+import os
+
 default_size = '7in,10in'
 
+# gnuplot session pool (see pool.py): max. idle sessions, idle timeout in sec.
+pool_size = 4
+pool_timeout = 300.
+
+# output backend: 'ps' = postscript w/ prologue.ps converted via gs/convert,
+# 'cairo' = gnuplot writes cairo_formats directly (pdfcairo/pngcairo/svg)
+default_backend = 'ps'
+cairo_formats = ['pdf', 'png', 'svg']
+raster_density = 150 # dpi for png/jpg output
+run_converters = True
+
+# batched conversion (see gsbatch.py): gs processes per device (pdf/png/jpg)
+# and rendering threads per gs process
+batch_converters = False
+gs_workers = 2
+gs_threads = 4
+
+# data transfer to gnuplot: 'text' = ascii datablocks uploaded once per plot,
+# 'binary' = raw float64 buffers via files in transfer_dir (tmpfs if
+# available), 'inline' = ascii inlined in every plot command (gnuplot < 5)
+default_transfer = 'text'
+transfer_dir = '/dev/shm'
+
+# shared hdf5 store for all plots (None = one name.hdf5 per plot)
+hdf5_store = None
+
+# render cache (see cache.py): store directory and max. size in bytes
+cache_dir = os.path.join(os.path.expanduser('~'), '.ccsgp_cache')
+cache_size = 2 * 1024**3
+
+# out-of-core datasets (np.memmap, h5py) are processed in chunks of rows
+chunk_rows = 65536
+
+# stage timing records (see timing.py) are appended to this file if not None
+timing_sink = None
+
+# 2D maps (see make_map): gnuplot palette specification
+map_palette = 'rgbformulae 7,5,15'
+
+# render daemon (see daemon.py): socket, worker processes, jobs per lane
+daemon_socket = os.path.join('/tmp', 'ccsgp-%d.sock' % os.getuid())
+daemon_workers = None
+daemon_queue = 32
+
 default_key = [
   'spacing 1.2', 'samplen 1.5', 'reverse Left',
   'box lw 2', 'height 0.5', 'font ",22"'
@@ -56,5 +125,13 @@ default_colors = [
   'rgb "#222222"', 'rgb "#111111"', 'rgb "#000000"',
 ]
 
-from pint import UnitRegistry
-ureg = UnitRegistry()
+class _LazyUnitRegistry(object):
+  """pint UnitRegistry created on first use (importing pint is slow)"""
+  _ureg = None
+  def __getattr__(self, attr):
+    if _LazyUnitRegistry._ureg is None:
+      from pint import UnitRegistry
+      _LazyUnitRegistry._ureg = UnitRegistry()
+    return getattr(_LazyUnitRegistry._ureg, attr)
+
+ureg = _LazyUnitRegistry()
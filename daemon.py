@@ -0,0 +1,313 @@
+"""
+local render daemon running plot jobs of short-lived processes on warm workers
+
+* the daemon listens on a Unix socket (config.daemon_socket), each request
+  and reply is one line of JSON
+* jobs are the arguments of make_plot, make_panel or make_map, arrays are
+  passed as .npy files in transfer_dir (shared memory if tmpfs), large ones
+  are memory-mapped by the worker (see lazy.py), h5py datasets by reference
+* jobs wait in priority lanes 'high', 'normal' and 'low' of bounded size, a
+  job for a full lane is rejected right away (backpressure) and resubmitted
+  by the client w/ exponential backoff
+* the jobs run in a pool of forked worker processes which keep ccsgp
+  imported and their gnuplot/gs processes warm (see pool.py, gsbatch.py)
+* the status request returns queue depths, job counters and per-stage
+  latencies (see timing.aggregate) of recent jobs, incl. the stages 'queue'
+  (waiting time) and 'job' (run time in the worker)
+
+start the daemon::
+
+  python daemon.py [--socket <path>] [--workers 4] [--queue-size 32]
+
+and use it from a client::
+
+  from ccsgp.daemon import submit, status
+  outputs = submit('plot', [data, properties, titles], dict(name = 'test'))
+"""
+
+import os, sys, json, time, socket, signal, tempfile, threading, traceback
+import itertools, Queue
+import numpy as np
+from collections import OrderedDict, deque
+from multiprocessing import Pool, cpu_count
+from config import daemon_socket, daemon_workers, daemon_queue, transfer_dir
+from config import chunk_rows
+from lazy import is_lazy
+import timing
+
+lanes = ['high', 'normal', 'low']
+
+def _encode(obj, files):
+  """JSON-serializable job arguments, arrays are saved to .npy files
+
+  :param files: list the names of the written .npy files are appended to
+  :type files: list
+  """
+  if is_lazy(obj) and hasattr(obj, 'file') and not isinstance(obj, np.ndarray):
+    return { '__h5__': [obj.file.filename, obj.name] } # h5py dataset
+  if isinstance(obj, np.ndarray):
+    tmpdir = transfer_dir if os.path.isdir(transfer_dir) else None
+    fd, fname = tempfile.mkstemp(suffix = '.npy', prefix = 'ccsgp_job_', dir = tmpdir)
+    files.append(fname)
+    with os.fdopen(fd, 'wb') as f: np.save(f, obj)
+    return { '__npy__': fname }
+  if isinstance(obj, OrderedDict):
+    return { '__odict__': [ [k, _encode(v, files)] for k, v in obj.iteritems() ] }
+  if isinstance(obj, dict):
+    return dict((k, _encode(v, files)) for k, v in obj.iteritems())
+  if isinstance(obj, (list, tuple)): return [ _encode(v, files) for v in obj ]
+  if isinstance(obj, np.generic): return obj.item()
+  return obj
+
+def _decode(obj, handles):
+  """job arguments from their JSON representation (see _encode)
+
+  :param handles: list the opened h5py files are appended to (to be closed
+    after the job)
+  :type handles: list
+  """
+  if isinstance(obj, dict):
+    if '__npy__' in obj:
+      d = np.load(obj['__npy__'], mmap_mode = 'r')
+      return np.array(d) if d.ndim == 0 or d.shape[0] <= chunk_rows else d
+    if '__h5__' in obj:
+      import h5py
+      f = h5py.File(obj['__h5__'][0], 'r')
+      handles.append(f)
+      return f[obj['__h5__'][1]]
+    if '__odict__' in obj:
+      return OrderedDict((k, _decode(v, handles)) for k, v in obj['__odict__'])
+    return dict((k, _decode(v, handles)) for k, v in obj.iteritems())
+  if isinstance(obj, list): return [ _decode(v, handles) for v in obj ]
+  return obj
+
+def _render(job):
+  """run one job in a worker process
+
+  :returns: (absolute paths of output files, timing records, None) or (None,
+    [], formatted traceback)
+  """
+  from ccsgp import make_plot, make_panel, make_map
+  from myplot import MyPlot
+  from cache import render_cache
+  handles = []
+  try:
+    os.chdir(job['cwd'])
+    args, kwargs = _decode(job['args'], handles), _decode(job['kwargs'], handles)
+    kwargs['wait'] = True
+    func = { 'plot': make_plot, 'panel': make_panel, 'map': make_map }[job['kind']]
+    render_cache.last_hit = None
+    result = func(*args, **kwargs)
+    timer = getattr(result, 'timer', None) # None if served from the cache
+    records = list(timer.records) if timer is not None else []
+    if kwargs.get('compile_only'): outputs = [kwargs.get('name', 'test') + '.gpb']
+    elif result is None: outputs = render_cache.last_hit or []
+    elif isinstance(result, MyPlot): outputs = result.outputs()
+    else: outputs = result.files # panel: postproc.PostProcess
+    if isinstance(result, MyPlot): result.close()
+    return [ os.path.abspath(f) for f in outputs ], records, None
+  except Exception:
+    return None, [], traceback.format_exc()
+  finally:
+    for f in handles: f.close()
+
+class RenderDaemon(object):
+  """Unix socket server queueing plot jobs for a pool of warm workers
+
+  :param path: Unix socket to listen on
+  :type path: str
+  :param workers: number of worker processes, defaults to number of cores
+  :type workers: int
+  :param queue_size: maximum number of waiting jobs per priority lane
+  :type queue_size: int
+  :ivar done: number of jobs finished
+  :ivar failed: number of jobs which raised an error
+  :ivar rejected: number of jobs rejected because their lane was full
+  """
+  def __init__(self, path = daemon_socket, workers = daemon_workers, queue_size = daemon_queue):
+    self.path = path
+    self.workers = workers or cpu_count()
+    self.queue_size = queue_size
+    self.running = self.done = self.failed = self.rejected = 0
+    self._queue = Queue.PriorityQueue()
+    self._queued = dict((lane, 0) for lane in lanes)
+    self._seq = itertools.count() # FIFO within a lane
+    self._records = deque(maxlen = 10000) # stage records of recent jobs
+    self._lock = threading.Lock()
+
+  def serve_forever(self):
+    """start the workers and handle requests until terminated"""
+    pool = Pool(self.workers) # forked w/ all modules imported
+    for i in xrange(self.workers): # one dispatcher per worker
+      t = threading.Thread(target = self._dispatch, args = (pool,))
+      t.daemon = True
+      t.start()
+    sock = self._listen()
+    try:
+      while True:
+        conn, addr = sock.accept()
+        t = threading.Thread(target = self._handle, args = (conn,))
+        t.daemon = True
+        t.start()
+    finally:
+      sock.close()
+      os.remove(self.path)
+      pool.terminate()
+
+  def _listen(self):
+    """bind the socket, replacing a stale one of a daemon no longer running"""
+    if os.path.exists(self.path):
+      try:
+        _connect(self.path).close()
+        raise RuntimeError('render daemon already running on %s' % self.path)
+      except socket.error: os.remove(self.path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(self.path)
+    os.chmod(self.path, 0600)
+    sock.listen(128)
+    return sock
+
+  def _handle(self, conn):
+    """answer one request (status or render)"""
+    try:
+      request = json.loads(conn.makefile('r').readline())
+      if request.get('op') == 'status': reply = self.status()
+      elif request.get('op') == 'render': reply = self._submit(request)
+      else: reply = { 'error': "unknown request '%s'" % request.get('op') }
+      conn.sendall(json.dumps(reply) + '\n')
+    except (socket.error, ValueError): pass # client gone or garbled request
+    finally: conn.close()
+
+  def _submit(self, request):
+    """queue a render job and wait for its result
+
+    :returns: reply w/ outputs or error, or busy if the lane is full
+    """
+    lane = request.get('priority', 'normal')
+    if lane not in lanes: return { 'error': "unknown priority '%s'" % lane }
+    if request.get('kind') not in ['plot', 'panel', 'map']:
+      return { 'error': "unknown job kind '%s'" % request.get('kind') }
+    with self._lock:
+      if self._queued[lane] >= self.queue_size:
+        self.rejected += 1
+        return { 'busy': True, 'queued': self._queued[lane] }
+      self._queued[lane] += 1
+    entry = dict(
+      lane = lane, submitted = time.time(), event = threading.Event(),
+      job = dict((k, request[k]) for k in ['kind', 'args', 'kwargs', 'cwd'])
+    )
+    self._queue.put((lanes.index(lane), next(self._seq), entry))
+    entry['event'].wait()
+    return entry['reply']
+
+  def _dispatch(self, pool):
+    """hand queued jobs to the worker pool in order of priority"""
+    while True:
+      prio, seq, entry = self._queue.get()
+      with self._lock:
+        self._queued[entry['lane']] -= 1
+        self.running += 1
+      start = time.time()
+      try: outputs, records, err = pool.apply(_render, (entry['job'],))
+      except Exception: outputs, records, err = None, [], traceback.format_exc()
+      name = entry['job']['kwargs'].get('name', 'test')
+      records += [
+        dict(plot = name, stage = stage, start = t0, wall = t1 - t0, cpu = 0., maxrss = 0.)
+        for stage, t0, t1 in [
+          ('queue', entry['submitted'], start), ('job', start, time.time())
+        ]
+      ]
+      with self._lock:
+        self.running -= 1
+        if err is None: self.done += 1
+        else: self.failed += 1
+        self._records.extend(records)
+      entry['reply'] = { 'outputs': outputs } if err is None else { 'error': err }
+      entry['event'].set()
+
+  def status(self):
+    """queue depth per lane, job counters and per-stage latencies
+
+    :returns: dict w/ workers, queue_size, queued, running, done, failed,
+      rejected and stages (see timing.aggregate)
+    """
+    with self._lock:
+      return dict(
+        workers = self.workers, queue_size = self.queue_size,
+        queued = dict(self._queued), running = self.running, done = self.done,
+        failed = self.failed, rejected = self.rejected,
+        stages = timing.aggregate(list(self._records))
+      )
+
+def _connect(path):
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.connect(path)
+  return sock
+
+def _request(message, path):
+  """send one request to the daemon and return its reply"""
+  sock = _connect(path)
+  try:
+    sock.sendall(json.dumps(message) + '\n')
+    line = sock.makefile('r').readline()
+  finally: sock.close()
+  if not line: raise RuntimeError('render daemon closed the connection')
+  return json.loads(line)
+
+def submit(kind, args, kwargs = None, priority = 'normal', path = None,
+           retries = 20, backoff = 0.05):
+  """render a plot in the daemon and wait for it
+
+  :param kind: 'plot', 'panel' or 'map' for make_plot, make_panel, make_map
+  :type kind: str
+  :param args: positional arguments, e.g. [data, properties, titles]
+  :type args: list
+  :param kwargs: keyword arguments (relative names refer to the current
+    directory)
+  :type kwargs: dict
+  :param priority: 'high', 'normal' or 'low'
+  :type priority: str
+  :param path: socket of the daemon, defaults to config.daemon_socket
+  :type path: str
+  :param retries: number of resubmissions while the lane is full
+  :type retries: int
+  :param backoff: initial wait in seconds before a resubmission (doubled
+    each time)
+  :type backoff: float
+  :returns: list of absolute paths of the output files
+  :raises: RuntimeError if the job failed or the lane stayed full
+  """
+  files = []
+  try:
+    message = dict(
+      op = 'render', kind = kind, priority = priority, cwd = os.getcwd(),
+      args = _encode(list(args), files), kwargs = _encode(kwargs or {}, files)
+    )
+    for i in xrange(retries + 1):
+      reply = _request(message, path or daemon_socket)
+      if not reply.get('busy'): break
+      time.sleep(backoff * 2**min(i, 6))
+    else: raise RuntimeError('render daemon queue full (%s lane)' % priority)
+  finally:
+    for f in files:
+      try: os.remove(f)
+      except OSError: pass
+  if 'error' in reply: raise RuntimeError('rendering failed:\n' + reply['error'])
+  return reply['outputs']
+
+def status(path = None):
+  """status of the daemon (see RenderDaemon.status)"""
+  return _request({ 'op': 'status' }, path or daemon_socket)
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description = 'ccsgp render daemon')
+  parser.add_argument('--socket', default = daemon_socket, help = 'Unix socket')
+  parser.add_argument('--workers', type = int, default = daemon_workers,
+                      help = 'number of worker processes')
+  parser.add_argument('--queue-size', type = int, default = daemon_queue,
+                      help = 'maximum number of waiting jobs per lane')
+  args = parser.parse_args()
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # clean up
+  import ccsgp # imported once, inherited by the workers
+  RenderDaemon(args.socket, args.workers, args.queue_size).serve_forever()
@@ -0,0 +1,193 @@
+"""
+reduce very large datasets to what the output resolution can show
+
+* ``minmax``: keep the points w/ minimum and maximum y in each pixel column
+* ``lttb``: largest-triangle-three-buckets downsampling (x sorted data)
+* kept points keep their own errors, i.e. error bars aren't inflated (and
+  don't turn into limit arrows on log y-axes), the points whose error bars
+  reach furthest in each pixel column (bucket for lttb) are kept in
+  addition, i.e. the envelope of all error bars stays the same
+* datasets w/ less than two points per pixel column are returned unchanged
+* ``decimate_chunks``: min-max decimation w/ bounded memory for datasets
+  given as chunks of rows (out-of-core data, see lazy.py)
+* ``in_range``: restrict a dataset to a visible x-range before decimation
+
+:var methods: supported decimation methods
+"""
+
+import numpy as np
+
+def _pixel_columns(x, npix, log = False, xrange = None):
+  """index of the pixel column for each x-value
+
+  :param xrange: x-range covered by the pixel columns, defaults to the
+    range of ``x``, points left/right of it are put into the extra columns
+    -1/npix
+  :type xrange: tuple
+  """
+  if log: x = np.log10(np.where(x > 0, x, np.nan))
+  if xrange is None: lo, hi = np.nanmin(x), np.nanmax(x)
+  else: lo, hi = np.log10(xrange) if log else xrange
+  if not hi > lo: return np.zeros(len(x), dtype = int)
+  idx = np.floor((x - lo) / (hi - lo) * npix)
+  idx[x == hi] = npix - 1 # upper edge belongs to the last column
+  return np.nan_to_num(idx).clip(-1, npix).astype(int)
+
+def _error_ends(d):
+  """pairs of lower and upper ends of the error bars of dataset ``d``"""
+  x, y = d[:, 0], d[:, 1]
+  ends = [(x - d[:, 2], x + d[:, 2])] if d.shape[1] > 2 else []
+  return ends + [ (y - d[:, i], y + d[:, i]) for i in xrange(3, d.shape[1]) ]
+
+def _extreme_rows(idx, ends):
+  """rows w/ the lowest lower and highest upper ends in each group
+
+  :param idx: group (pixel column, bucket) of each row
+  :type idx: numpy.array
+  :param ends: pairs of lower/upper values, e.g. y-dy/y+dy (see _error_ends)
+  :type ends: list
+  :returns: numpy.array of row indices (first row in case of ties, NaN is
+    ignored)
+  """
+  order = np.argsort(idx, kind = 'mergesort')
+  groups = idx[order]
+  first = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+  counts = np.diff(np.r_[first, len(idx)])
+  rows = [np.zeros(0, dtype = int)]
+  for lower, upper in ends:
+    for v, extreme in [(lower[order], np.fmin), (upper[order], np.fmax)]:
+      hit = np.flatnonzero(v == np.repeat(extreme.reduceat(v, first), counts))
+      rows.append(order[hit[np.r_[True, np.diff(groups[hit]) != 0]]])
+  return np.concatenate(rows)
+
+def minmax(d, npix, log = False, xrange = None):
+  """min-max decimation per pixel column
+
+  :param d: dataset w/ format [x, y, dx, dy1, dy2]
+  :type d: numpy.array
+  :param npix: number of pixel columns
+  :type npix: int
+  :param log: logarithmic x-axis
+  :type log: bool
+  :param xrange: x-range covered by the pixel columns (see _pixel_columns)
+  :type xrange: tuple
+  :returns: numpy.array in original order w/ at most two points per pixel
+    column (incl. the extra columns outside of xrange) for y and each error
+    column
+  """
+  if len(d) <= 2 * npix: return d
+  return _minmax(d, npix, log, xrange)
+
+def _minmax(d, npix, log = False, xrange = None):
+  """min-max decimation of a non-empty dataset (see minmax)"""
+  idx = _pixel_columns(d[:, 0], npix, log, xrange)
+  y = d[:, 1]
+  return d[np.unique(_extreme_rows(idx, [(y, y)] + _error_ends(d)))]
+
+def lttb(d, npix, log = False):
+  """largest-triangle-three-buckets decimation to 2*npix points (plus the
+  points w/ the furthest reaching error bars in each bucket)
+
+  :param d: dataset sorted in x w/ format [x, y, dx, dy1, dy2]
+  :type d: numpy.array
+  :param npix: number of pixel columns
+  :type npix: int
+  :param log: logarithmic x-axis (triangle areas in log10(x))
+  :type log: bool
+  :returns: numpy.array
+  """
+  n, nout = len(d), 2 * npix
+  if n <= 2 * nout: return d
+  x = np.log10(np.where(d[:, 0] > 0, d[:, 0], np.nan)) if log else d[:, 0]
+  x, y = np.nan_to_num(x), d[:, 1]
+  edges = np.linspace(1, n - 1, nout - 1).astype(int)
+  rows, a = [0], 0
+  for i in xrange(nout - 2):
+    lo, hi = edges[i], edges[i + 1]
+    nhi = edges[i + 2] if i + 2 < len(edges) else n
+    avg_x, avg_y = x[hi:nhi].mean(), y[hi:nhi].mean()
+    area = np.abs(
+      (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+    )
+    a = lo + area.argmax()
+    rows.append(a)
+  rows.append(n - 1)
+  ends = _error_ends(d)
+  if not ends: return d[rows]
+  bucket = np.zeros(n, dtype = int)
+  bucket[edges] = 1
+  return d[np.union1d(rows, _extreme_rows(np.cumsum(bucket), ends))]
+
+methods = { 'minmax': minmax, 'lttb': lttb }
+
+def decimate_chunks(chunks, method, npix, xrange, log = False):
+  """decimate a dataset given as chunks of rows
+
+  * chunks are merged w/ the result so far which is min-max decimated on the
+    pixel columns of the full ``xrange`` once the dataset has more than
+    2*npix points, i.e. at most 2*npix points plus one chunk are kept in
+    memory and the result is the same as for minmax on the full dataset
+  * 'lttb' can't be applied across chunks and falls back to minmax
+
+  :param chunks: chunks of rows in x order (see lazy.chunks)
+  :type chunks: iterable
+  :param method: decimation method (see methods)
+  :type method: str
+  :param npix: number of pixel columns
+  :type npix: int
+  :param xrange: x-range of the full dataset (min. positive x for log)
+  :type xrange: tuple
+  :param log: logarithmic x-axis
+  :type log: bool
+  :returns: numpy.array
+  """
+  if method not in methods:
+    raise ValueError("unknown decimation method '{0}'!".format(method))
+  out, n = None, 0
+  for c in chunks:
+    n += len(c)
+    out = c if out is None else np.concatenate((out, c))
+    if n > 2 * npix: out = _minmax(out, npix, log, xrange)
+  return out
+
+def in_range(chunks, xrange):
+  """rows w/ x inside ``xrange`` and their direct neighbours outside of it,
+  i.e. both ends of all lines passing through the visible window (also if
+  no row is inside), also across chunk boundaries
+
+  :param chunks: chunks of rows (see lazy.chunks)
+  :type chunks: iterable
+  :param xrange: lower and upper x-limit
+  :type xrange: tuple
+  :returns: generator of chunks (at least one, maybe empty)
+  """
+  lo, hi = xrange
+  last, empty = None, None # last row of the previous chunk, whether kept
+  for c in chunks:
+    if not len(c):
+      empty = c
+      continue
+    rows = c if last is None else np.concatenate((last[0][np.newaxis], c))
+    x = rows[:, 0]
+    inside, below, above = (x >= lo) & (x <= hi), x < lo, x > hi
+    line = inside[:-1] | inside[1:] | (below[:-1] & above[1:]) | (
+      above[:-1] & below[1:]
+    ) # line between consecutive rows passes through the window
+    keep = inside.copy()
+    keep[:-1] |= line
+    keep[1:] |= line
+    if last is not None and last[1]: keep[0] = False # yielded already
+    last = (c[-1], keep[-1])
+    yield rows[keep]
+  if last is None and empty is not None: yield empty
+
+def decimate(d, method, npix, log = False, xrange = None):
+  """decimate dataset ``d`` w/ given method (see methods)
+
+  :param xrange: x-range of the pixel columns (minmax only, see minmax)
+  :type xrange: tuple
+  """
+  if method not in methods:
+    raise ValueError("unknown decimation method '{0}'!".format(method))
+  if method == 'minmax': return minmax(d, npix, log = log, xrange = xrange)
+  return methods[method](d, npix, log = log)
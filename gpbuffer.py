@@ -0,0 +1,110 @@
+"""
+buffered command stream to a gnuplot session
+
+commands are collected and written to gnuplot in one go right before the
+next plot/replot or on an explicit ``flush``, i.e. their order relative to
+plot commands is preserved.
+"""
+
+import os, time, tempfile
+
+def sync(gp):
+  """wait until gnuplot session ``gp`` processed all commands sent so far
+
+  gnuplot touches a flag file once it reaches the command
+  """
+  fd, flag = tempfile.mkstemp(prefix = 'ccsgp_sync_')
+  os.close(fd)
+  os.remove(flag)
+  gp('system "touch %s"' % flag)
+  while not os.path.exists(flag): time.sleep(0.005)
+  os.remove(flag)
+
+class CommandBuffer(object):
+  """buffering wrapper around a Gnuplot.Gnuplot session
+
+  all attributes not defined here are forwarded to the wrapped session
+
+  :param gp: gnuplot session
+  :type gp: Gnuplot.Gnuplot
+  :ivar ncommands: number of commands sent (incl. plot commands)
+  :ivar nbytes: number of bytes written to the gnuplot pipe (incl. data)
+  :ivar nwrites: number of buffered writes
+  """
+  def __init__(self, gp):
+    self.gp = gp
+    self.buffer = []
+    self.ncommands = 0
+    self.nbytes = 0
+    self.nwrites = 0
+    proc = gp.gnuplot
+    self._write = proc.write
+    def counting_write(s):
+      self.nbytes += len(s)
+      self._write(s)
+    proc.write = counting_write
+
+  def __call__(self, s):
+    """queue a gnuplot command"""
+    self.buffer.append(s)
+    self.ncommands += 1
+
+  def __getattr__(self, attr):
+    return getattr(self.gp, attr)
+
+  def flush(self):
+    """send all queued commands in one write"""
+    if not self.buffer: return
+    cmds, self.buffer = self.buffer, []
+    self.nwrites += 1
+    self.gp('\n'.join(cmds))
+
+  def sync(self):
+    """flush and wait until gnuplot processed all commands (e.g. until
+    ``set output`` closed an output file)"""
+    self.flush()
+    self.ncommands += 1
+    sync(self.gp)
+
+  def stream(self, parts):
+    """flush queued commands and write one command in parts (e.g. large
+    datablocks) w/o assembling it in memory
+
+    :param parts: strings, the last one has to end the command w/ a newline
+    :type parts: iterable
+    """
+    self.flush()
+    self.ncommands += 1
+    write = self.gp.gnuplot.write
+    for s in parts: write(s)
+    self.gp.gnuplot.flush()
+
+  def plot(self, *items):
+    """flush queued commands and plot"""
+    self.flush()
+    self.ncommands += 1
+    self.gp.plot(*items)
+
+  def splot(self, *items):
+    """flush queued commands and splot"""
+    self.flush()
+    self.ncommands += 1
+    self.gp.splot(*items)
+
+  def refresh(self):
+    """flush queued commands and replot"""
+    self.flush()
+    self.ncommands += 1
+    self.gp.refresh()
+
+  def detach(self):
+    """flush and return the wrapped session w/o byte counting"""
+    self.flush()
+    self.gp.gnuplot.write = self._write
+    return self.gp
+
+  def stats(self):
+    """commands, bytes and writes sent through this buffer"""
+    return {
+      'commands': self.ncommands, 'bytes': self.nbytes, 'writes': self.nwrites
+    }
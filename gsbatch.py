@@ -0,0 +1,177 @@
+"""
+batched ghostscript conversion of postscript hardcopies into pdf, png and jpg
+
+* one long-lived gs process per output device (pdfwrite, png16m, jpeg)
+  reads the conversion jobs of many plots as postscript from its stdin, i.e.
+  process startup and font loading are paid once instead of for every figure
+  and format
+* png and jpg are rendered by gs itself from the postscript original w/
+  anti-aliasing and multi-threaded rendering instead of rasterizing the pdf
+  w/ ImageMagick's convert
+* page size (derived from the plot's size string) and page offset are the
+  same as for the single gs call of postproc.convert_pdf
+* concurrent jobs (e.g. hardcopies of make_plots) are queued per device and
+  served by at most ``workers`` gs processes per device
+* a job's output file is finalized by switching gs to the next output file
+  (/dev/null), gs then reports the job's status on stdout
+* a failed job's VM state is restored, its gs process is ended nevertheless
+* opt-in via config.batch_converters: gs runs w/o -dSAFER, i.e. w/ full
+  file system access
+
+:var gs_batch: module-wide converter used by postproc.hardcopy
+"""
+
+import threading
+from subprocess import Popen, PIPE
+from config import raster_density, gs_workers, gs_threads
+from utils import size_dims
+
+_devices = { '.pdf': 'pdfwrite', '.png': 'png16m', '.jpg': 'jpeg' }
+
+# a failed job's operands/dictionaries are dropped before its VM is restored
+_job = '''{
+  << /OutputFile %(output)s /PageSize [%(width)d %(height)d]
+     /PageOffset [-50 -50] >> setpagedevice
+  userdict /ccsgp_save save put
+  %(eps)s run
+  userdict /ccsgp_save get restore
+} stopped {
+  clear cleardictstack
+  userdict /ccsgp_save known { userdict /ccsgp_save get restore } if
+  (ccsgp:error\\n)
+} { (ccsgp:ok\\n) } ifelse
+<< /OutputFile (/dev/null) >> setpagedevice
+print flush
+'''
+
+def _ps_string(s):
+  """postscript string literal of ``s``"""
+  return '(%s)' % s.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def _command(device):
+  """gs command line reading jobs for ``device`` from stdin
+
+  -dNOSAFER lets the jobs change the output file and read the (own)
+  postscript originals
+  """
+  cmd = [
+    'gs', '-q', '-dBATCH', '-dNOPAUSE', '-dNOSAFER', '-sDEVICE=%s' % device,
+    '-sOutputFile=/dev/null'
+  ]
+  if device != 'pdfwrite':
+    cmd += [
+      '-r%d' % raster_density, '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4'
+    ]
+    if gs_threads > 1: # threads render bands, i.e. always use banding
+      cmd += ['-dNumRenderingThreads=%d' % gs_threads, '-dMaxBitmap=0']
+  if device == 'jpeg': cmd.append('-dJPEGQ=92')
+  return cmd + ['-']
+
+class _Ghostscript(object):
+  """gs process converting one job at a time
+
+  :param device: gs output device
+  :type device: str
+  """
+  def __init__(self, device):
+    self.device = device
+    self.proc = Popen(_command(device), stdin = PIPE, stdout = PIPE, close_fds = True)
+
+  def run(self, output, epsname, width, height):
+    """convert ``epsname`` into ``output`` on a page of width x height points
+
+    :returns: True if gs converted the job w/o error
+    :raises: RuntimeError if gs died
+    """
+    self.proc.stdin.write(_job % dict(
+      output = _ps_string(output), eps = _ps_string(epsname),
+      width = width, height = height
+    ))
+    self.proc.stdin.flush()
+    while True: # skip output of the postscript itself
+      line = self.proc.stdout.readline()
+      if not line:
+        raise RuntimeError('gs (%s) died converting %s' % (self.device, epsname))
+      if line.startswith('ccsgp:'): return line.strip() == 'ccsgp:ok'
+
+  def close(self):
+    """end gs, ignoring broken pipes"""
+    try:
+      self.proc.stdin.close()
+      self.proc.wait()
+    except (IOError, OSError): pass
+
+class GSBatch(object):
+  """long-lived gs processes shared by all hardcopies
+
+  :param workers: maximum number of gs processes per device
+  :type workers: int
+  :ivar jobs: number of files converted
+  :ivar spawns: total number of gs processes started
+  """
+  def __init__(self, workers = gs_workers):
+    self.workers = workers
+    self.jobs = 0
+    self.spawns = 0
+    self._idle = {} # device -> list of _Ghostscript
+    self._slots = {} # device -> semaphore limiting the gs processes
+    self._lock = threading.Lock()
+
+  def convert(self, name, epsname, size, ext):
+    """convert eps/ps original into the format given by extension ``ext``
+
+    blocks until the output file is written (queued behind running jobs)
+
+    :param name: basename of the output file
+    :type name: str
+    :param epsname: postscript original
+    :type epsname: str
+    :param size: size string '<height>,<width>'
+    :type size: str
+    :param ext: '.pdf', '.png' or '.jpg'
+    :type ext: str
+    :raises: RuntimeError if the conversion failed
+    """
+    device = _devices[ext]
+    width, height = [ int(d) for d in size_dims(size, 'point') ]
+    with self._lock:
+      slot = self._slots.setdefault(device, threading.BoundedSemaphore(self.workers))
+    with slot:
+      with self._lock:
+        idle = self._idle.setdefault(device, [])
+        gs = idle.pop() if idle else None
+        if gs is None: self.spawns += 1
+      if gs is None: gs = _Ghostscript(device)
+      try: ok = gs.run(name + ext, epsname, width, height)
+      except (IOError, OSError, RuntimeError): # gs died, don't recycle
+        gs.close()
+        raise
+      if not ok: gs.close() # don't recycle after a failed job
+      with self._lock:
+        if ok: self._idle[device].append(gs)
+        self.jobs += 1
+    if not ok: raise RuntimeError('gs failed to convert %s into %s' % (epsname, name + ext))
+
+  def detach(self):
+    """forget gs processes inherited from a parent process (after fork)"""
+    self._idle, self._slots = {}, {}
+    self._lock = threading.Lock()
+
+  def clear(self):
+    """end all idle gs processes"""
+    with self._lock:
+      for procs in self._idle.itervalues():
+        for gs in procs: gs.close()
+      self._idle = {}
+
+  def stats(self):
+    """job and spawn counters
+
+    :returns: dict w/ jobs, spawns and idle
+    """
+    return {
+      'jobs': self.jobs, 'spawns': self.spawns,
+      'idle': sum(len(p) for p in self._idle.itervalues())
+    }
+
+gs_batch = GSBatch()
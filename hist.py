@@ -0,0 +1,210 @@
+"""
+histograms of raw values in make_plot's dataset format [x, y, dx, dy1, dy2]
+
+* bins: number of fixed-width bins in a range (linear or logarithmic) or
+  array of variable bin edges
+* values w/ optional weights are filled in chunks of rows, also from
+  out-of-core arrays (see lazy.py), optionally by several threads
+* x = bin center, dx = half bin width, y = sum of weights (or density),
+  dy1 = sqrt(sum of squared weights), dy2 = relative systematic uncertainty
+* ``rebin`` merges adjacent bins of existing histogram datasets
+"""
+
+import numpy as np
+from itertools import izip
+from multiprocessing.pool import ThreadPool
+from lazy import chunks
+
+class Histogram(object):
+  """accumulates sum of weights and sum of squared weights per bin
+
+  :param bins: number of bins or array of bin edges
+  :type bins: int or numpy.array
+  :param range: lower and upper edge for a number of bins
+  :type range: list
+  :param log: logarithmic fixed-width bins (range has to be positive)
+  :type log: bool
+  :ivar edges: bin edges
+  :ivar sumw: sum of weights per bin
+  :ivar sumw2: sum of squared weights per bin
+  :ivar entries: number of values filled (incl. out of range)
+  """
+  def __init__(self, bins, range = None, log = False):
+    if np.isscalar(bins):
+      if range is None: raise ValueError('range required for %d bins!' % bins)
+      lo, hi = range
+      if log and not lo > 0: raise ValueError('log bins need a positive range!')
+      self._fixed = (np.log10(lo), np.log10(hi)) if log else (float(lo), float(hi))
+      self.edges = np.logspace(self._fixed[0], self._fixed[1], bins + 1) \
+              if log else np.linspace(lo, hi, bins + 1)
+    else:
+      self._fixed = None
+      self.edges = np.asarray(bins, dtype = np.float64)
+      if np.any(np.diff(self.edges) <= 0):
+        raise ValueError('bin edges have to increase monotonically!')
+    self.log = log
+    self.nbins = len(self.edges) - 1
+    self.sumw = np.zeros(self.nbins)
+    self.sumw2 = np.zeros(self.nbins)
+    self.entries = 0
+
+  def _index(self, v):
+    """bin index of each value, -1 if out of range (upper edge included)"""
+    if self._fixed is not None: # direct computation instead of search
+      lo, hi = self._fixed
+      x = np.log10(np.where(v > 0, v, np.nan)) if self.log else v
+      idx = np.floor((x - lo) * (self.nbins / (hi - lo)))
+      idx[x == hi] = self.nbins - 1
+      idx[~((idx >= 0) & (idx < self.nbins))] = -1 # incl. nan
+      return idx.astype(np.intp)
+    idx = np.searchsorted(self.edges, v, side = 'right') - 1
+    idx[v == self.edges[-1]] = self.nbins - 1
+    idx[(idx >= self.nbins) | ~(v >= self.edges[0])] = -1
+    return idx
+
+  def _sums(self, v, w):
+    """sum of weights and squared weights per bin for one chunk"""
+    v = np.asarray(v, dtype = np.float64)
+    idx = self._index(v)
+    ok = idx >= 0
+    idx = idx[ok]
+    if w is None:
+      sumw = np.bincount(idx, minlength = self.nbins).astype(np.float64)
+      return sumw, sumw
+    w = np.asarray(w, dtype = np.float64)[ok]
+    return (
+      np.bincount(idx, weights = w, minlength = self.nbins),
+      np.bincount(idx, weights = w * w, minlength = self.nbins)
+    )
+
+  def fill(self, values, weights = None, threads = None):
+    """fill values w/ optional weights, chunk by chunk
+
+    :param values: raw values, also out-of-core (see lazy.py)
+    :type values: numpy.array
+    :param weights: weight of each value, defaults to 1
+    :type weights: numpy.array
+    :param threads: number of threads filling chunks concurrently
+    :type threads: int
+    :returns: self
+    """
+    if weights is None: parts = ((v, None) for v in chunks(values))
+    else: parts = izip(chunks(values), chunks(weights))
+    if not threads or threads < 2:
+      for v, w in parts: self._add(v, self._sums(v, w))
+      return self
+    pool = ThreadPool(threads)
+    try:
+      batch = []
+      for part in parts: # at most ``threads`` chunks in memory at once
+        batch.append(part)
+        if len(batch) == threads:
+          self._add_batch(pool, batch)
+          batch = []
+      if batch: self._add_batch(pool, batch)
+    finally:
+      pool.close()
+      pool.join()
+    return self
+
+  def _add_batch(self, pool, batch):
+    for (v, w), sums in zip(batch, pool.map(lambda p: self._sums(*p), batch)):
+      self._add(v, sums)
+
+  def _add(self, v, sums):
+    self.sumw += sums[0]
+    self.sumw2 += sums[1]
+    self.entries += len(v)
+
+  def __iadd__(self, other):
+    """merge another histogram w/ identical bins (e.g. from a worker)"""
+    if not np.array_equal(self.edges, other.edges):
+      raise ValueError('histograms w/ different bins can\'t be merged!')
+    self.sumw += other.sumw
+    self.sumw2 += other.sumw2
+    self.entries += other.entries
+    return self
+
+  def dataset(self, density = False, sys = 0.):
+    """histogram in the format [x, y, dx, dy1, dy2] (see make_plot)
+
+    :param density: divide by bin width (and total sum of weights if
+      density is 'normed')
+    :type density: bool or str
+    :param sys: relative systematic uncertainty
+    :type sys: float
+    :returns: numpy.array
+    """
+    lo, hi = self.edges[:-1], self.edges[1:]
+    y, dy = self.sumw.copy(), np.sqrt(self.sumw2)
+    if density:
+      norm = (hi - lo) * (self.sumw.sum() if density == 'normed' else 1.)
+      y, dy = y / norm, dy / norm
+    return np.column_stack(((lo + hi) / 2., y, (hi - lo) / 2., dy, sys * np.abs(y)))
+
+def histogram(values, bins, range = None, weights = None, log = False,
+              density = False, sys = 0., threads = None):
+  """histogram raw values into a dataset ready for make_plot/make_panel
+
+  :param values: raw values, also out-of-core (see lazy.py)
+  :type values: numpy.array
+  :param bins: number of bins or array of bin edges
+  :type bins: int or numpy.array
+  :param range: lower and upper edge for a number of bins, defaults to the
+    range of the values
+  :type range: list
+  :param weights: weight of each value
+  :type weights: numpy.array
+  :param log: logarithmic fixed-width bins
+  :type log: bool
+  :param density: see Histogram.dataset
+  :type density: bool or str
+  :param sys: relative systematic uncertainty
+  :type sys: float
+  :param threads: number of threads filling chunks concurrently
+  :type threads: int
+  :returns: numpy.array w/ format [x, y, dx, dy1, dy2]
+  """
+  if np.isscalar(bins) and range is None:
+    lo, hi = np.inf, -np.inf
+    for c in chunks(values):
+      c = c[c > 0] if log else c
+      if len(c): lo, hi = min(lo, c.min()), max(hi, c.max())
+    if lo > hi: raise ValueError('no values to determine the range!')
+    range = [lo, hi if hi > lo else lo + 1.]
+  h = Histogram(bins, range, log)
+  return h.fill(values, weights, threads).dataset(density, sys)
+
+def rebin(d, bins, density = False):
+  """merge adjacent bins of a histogram dataset
+
+  * y and dy2 (systematic, fully correlated) are summed, dy1 is summed in
+    quadrature
+  * new bin edges have to coincide w/ edges of the dataset
+
+  :param d: histogram w/ format [x, y, dx, dy1, dy2] (see Histogram.dataset)
+  :type d: numpy.array
+  :param bins: number of adjacent bins to merge or array of new bin edges
+  :type bins: int or numpy.array
+  :param density: y (and errors) are densities, i.e. per bin width
+  :type density: bool
+  :returns: numpy.array
+  """
+  d = np.asarray(d, dtype = np.float64)
+  lo, hi = d[:, 0] - d[:, 2], d[:, 0] + d[:, 2]
+  if np.isscalar(bins):
+    edges = np.r_[lo[::bins], hi[-1]]
+  else:
+    edges = np.asarray(bins, dtype = np.float64)
+  old = np.r_[lo, hi[-1]]
+  if not np.all(np.isclose(old[np.abs(old[:, np.newaxis] - edges).argmin(0)], edges)):
+    raise ValueError('new bin edges have to coincide w/ old ones!')
+  idx = np.searchsorted(edges, d[:, 0]) - 1 # by bin center
+  ok = (idx >= 0) & (idx < len(edges) - 1)
+  width = hi - lo if density else 1.
+  col = lambda i: d[:, i] * width if d.shape[1] > i else np.zeros(len(d))
+  merge = lambda v: np.bincount(idx[ok], weights = v[ok], minlength = len(edges) - 1)
+  y, dy1, dy2 = merge(col(1)), np.sqrt(merge(col(3)**2)), merge(col(4))
+  nlo, nhi = edges[:-1], edges[1:]
+  if density: y, dy1, dy2 = [ c / (nhi - nlo) for c in [y, dy1, dy2] ]
+  return np.column_stack(((nlo + nhi) / 2., y, (nhi - nlo) / 2., dy1, dy2))
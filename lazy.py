@@ -0,0 +1,25 @@
+"""
+out-of-core datasets: np.memmap arrays and h5py datasets (or anything else
+w/ shape, dtype and numpy-style row slicing) are processed in chunks of rows
+so that memory use doesn't depend on the dataset size
+"""
+
+import numpy as np
+from config import chunk_rows
+
+def is_lazy(d):
+  """whether ``d`` is an out-of-core dataset"""
+  if isinstance(d, np.memmap): return len(d.shape) >= 1
+  return not isinstance(d, (np.ndarray, np.generic)) and hasattr(d, 'shape') \
+          and hasattr(d, 'dtype') and len(d.shape) >= 1
+
+def chunks(d, rows = None):
+  """in-memory chunks of rows of dataset ``d`` (at least one, maybe empty)
+
+  :param d: dataset
+  :type d: numpy.memmap or h5py.Dataset
+  :param rows: rows per chunk, defaults to config.chunk_rows
+  :type rows: int
+  """
+  if rows is None: rows = chunk_rows
+  for i in xrange(0, max(d.shape[0], 1), rows): yield np.asarray(d[i:i+rows])
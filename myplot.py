@@ -1,13 +1,72 @@
-import os, re, sys
-import Gnuplot, Gnuplot.funcutils
-from subprocess import call
-from utils import zip_flat, colorscale
-from config import basic_setup, supported_styles, ureg, default_size
+import os, re, sys, tempfile
+from utils import colorscale, size_dims
+from config import basic_setup, supported_styles, default_size
+from config import default_backend, cairo_formats, raster_density
+from config import default_transfer, transfer_dir, hdf5_store, map_palette
+from pool import gnuplot_pool
+from gpbuffer import CommandBuffer
+import postproc
+from bundle import ScriptSession
+from decimate import decimate, decimate_chunks, in_range
+from lazy import is_lazy, chunks
+from timing import StageTimer, timed
 import numpy as np
 from collections import deque
 
 os.environ['GNUPLOT_PS_DIR'] = os.path.dirname(__file__)
 
+def _using_columns(using):
+  """0-based data columns referenced by a gnuplot using spec"""
+  return set(
+    int(f) - 1 for f in using.split(':') if f.isdigit()
+  ) | set(int(n) - 1 for n in re.findall('\$(\d+)', using))
+
+def _remap_using(using, cols):
+  """rewrite using spec for data reduced to the (0-based) columns ``cols``"""
+  idx = dict((c + 1, i + 1) for i, c in enumerate(cols))
+  return ':'.join([
+    str(idx[int(f)]) if f.isdigit() else re.sub(
+      '\$(\d+)', lambda m: '$%d' % idx[int(m.group(1))], f
+    ) for f in using.split(':')
+  ])
+
+def _extrema(vals, lo, hi):
+  """extrema used for autoscaling, None if there are no values
+
+  :returns: (min(lo), max(hi), min(vals), min(vals > 0) or None)
+  """
+  if not len(vals): return None
+  pos = vals[vals > 0]
+  return (lo.min(), hi.max(), vals.min(), pos.min() if len(pos) else None)
+
+def is_map(dpt):
+  """whether panel entry ``dpt`` is a 2D map ``[z, xedges, yedges]`` rather
+  than make_plot's ``[data, properties, titles]``
+
+  z has to be 2D and the edges 1D numeric arrays, e.g. datasets given as
+  one 3D array are no map
+  """
+  if len(dpt) != 3: return False
+  z = dpt[0]
+  if not (is_lazy(z) or isinstance(z, np.ndarray)) or len(z.shape) != 2:
+    return False
+  for edges in dpt[1:]:
+    e = np.asarray(edges)
+    if e.ndim != 1 or not np.issubdtype(e.dtype, np.number): return False
+  return True
+
+def map_datasets(key, z, xedges, yedges):
+  """entries of a 2D map in dataSets (hdf5/ascii export)"""
+  return { key: z, key + '_xedges': xedges, key + '_yedges': yedges }
+
+def _merge_extrema(a, b):
+  """combine extrema of two parts of a dataset (see _extrema)"""
+  if a is None or b is None: return b if a is None else a
+  pos = [ p for p in (a[3], b[3]) if p is not None ]
+  return (
+    min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(pos) if pos else None
+  )
+
 class MyPlot(object):
   """base class
 
@@ -20,33 +79,205 @@ class MyPlot(object):
   :type name: str
   :param debug: debug flag for verbose gnuplot output
   :type debug: bool
+  :param backend: 'ps' for postscript converted via gs/convert (publication
+    quality) or 'cairo' to let gnuplot write pdf/png/svg directly
+  :type backend: str
+  :param transfer: 'text' to upload data once as ascii datablocks, 'binary'
+    to let gnuplot read the raw float64 buffers from files in
+    config.transfer_dir, 'inline' for inline ascii (gnuplot < 5)
+  :type transfer: str
+  :param bundle: compile-only mode, record the plot into this bundle
+    directory instead of running gnuplot (see bundle.py), implies binary
+    transfer
+  :type bundle: str
   :ivar name: basename for output files
   :ivar epsname: basename + '.eps'
-  :ivar gp: Gnuplot.Gnuplot instance
+  :ivar gp: gpbuffer.CommandBuffer around a Gnuplot.Gnuplot instance borrowed
+    from pool.gnuplot_pool
   :ivar nPanels: number of panels in a multiplot
   :ivar nVertLines: number of vertical lines
   :ivar nLabels: number of labels
   :ivar nArrows: number of arrows
   :ivar axisLog: flags for logarithmic axes
   :ivar axisRange: axis range for respective axis (set in setAxisRange)
+  :ivar plotcmd: 'plot' or 'splot' (pm3d maps, see initMap)
+  :ivar dataStats: per-dataset statistics for autoscaling (see _data_stats)
+  :ivar decimate: decimation method for plotted data (see decimate.py)
+  :ivar npix: number of pixel columns to decimate to
+  :ivar decimate_range: visible x-range the data is decimated over (None =
+    full data range)
+  :ivar hdf5_store: shared hdf5 store to write data into (see setExport)
+  :ivar hdf5_mode: 'overwrite' or 'append' the plot's group in hdf5_store
+  :ivar export_format: 'dat', 'npy', 'npz' or None for the data export
+  :ivar export_precision: digits after the decimal point for 'dat' export
+  :ivar export_background: run data export in a background thread
+  :ivar postprocess: handle of the last hardcopy's post-processing stages
+  :ivar timer: timing.StageTimer w/ timing records of all stages, incl.
+    post-processing (see timing.py)
   """
-  def __init__(self, name = 'test', title = '', debug = 0):
+  def __init__(
+    self, name = 'test', title = '', debug = 0, backend = None, transfer = None,
+    bundle = None
+  ):
+    self.backend = default_backend if backend is None else backend
+    if self.backend not in ['ps', 'cairo']:
+      raise ValueError("unknown backend '{0}'!".format(self.backend))
+    self.bundle = bundle
+    self.transfer = default_transfer if transfer is None else transfer
+    if bundle is not None: self.transfer = 'binary'
+    if self.transfer not in ['text', 'binary', 'inline']:
+      raise ValueError("unknown transfer mode '{0}'!".format(self.transfer))
+    self._sources = {} # (id, columns) -> (array, datablock name or file)
+    self._datablocks, self._binfiles = [], []
     self.name = name
     self.epsname = name + '.ps'
-    self.gp = Gnuplot.Gnuplot(debug = debug)
+    self.gp = CommandBuffer(
+      ScriptSession(bundle, debug = debug) if bundle is not None
+      else gnuplot_pool.acquire(debug = debug)
+    )
+    self.timer = StageTimer(name, counters = self.gp.stats)
     self.nPanels = 0
     self.nVertLines = 0
     self.nLabels = 0
     self.nArrows = 0
     self.axisLog = { 'x': False, 'y': False }
     self.axisRange = { 'x': [], 'y': [] }
+    self.plotcmd = 'plot'
     self.arrow_offset = 0.85
     self.arrow_length = 0.2
     self.arrow_bar = 0.005
+    self.hdf5_store = hdf5_store
+    self.hdf5_mode = 'overwrite'
+    self.export_format = 'dat'
+    self.export_precision = 4
+    self.export_background = False
     self.dataSets = {}
+    self.dataStats = {}
     self.size = None
+    self.decimate = None
+    self._layout_inputs = None # see _layout
+    self._base_data = [] # plot items w/o horizontal lines (see repeat_plots)
+    self.npix = None
+    self.decimate_range = None
+    self.postprocess = None
     self._setter(['title "%s"' % title] + basic_setup)
 
+  def close(self):
+    """hand gnuplot session back to the pool (plot can't be repeated after)
+
+    datablocks are undefined and binary data files are removed by gnuplot
+    itself to make sure they are not deleted before gnuplot read them
+    """
+    gp = getattr(self, 'gp', None)
+    if gp is None: return
+    if self.bundle is None: self._drop_sources()
+    self.gp = None
+    if self.bundle is not None: # script done, data files belong to bundle
+      gp.detach().close()
+      return
+    gnuplot_pool.release(gp.detach())
+
+  def _drop_sources(self):
+    """free all data uploaded to gnuplot (datablocks, binary data files)"""
+    if self._datablocks: self.gp('undefine %s' % ' '.join(self._datablocks))
+    if self._binfiles: self.gp('system "rm -f %s"' % ' '.join(self._binfiles))
+    self._sources, self._datablocks, self._binfiles = {}, [], []
+
+  def flush(self):
+    """send queued gnuplot commands right away (e.g. for interactive use)"""
+    self.gp.flush()
+
+  def _source(self, d, cols):
+    """upload dataset ``d`` to gnuplot once and return the string to plot it
+
+    :param d: dataset
+    :type d: numpy.array
+    :param cols: columns to upload (text transfer only)
+    :type cols: list
+    :returns: datablock name or binary file specification
+    """
+    key = (id(d), tuple(cols))
+    if key in self._sources: return self._sources[key][1]
+    with self.timer.stage('serialize'): source = self._serialize(d, cols)
+    self._sources[key] = (d, source) # keep d alive, its id is part of the key
+    return source
+
+  def _binfile(self):
+    """new binary data file in the bundle or transfer_dir (removed on close)
+
+    :returns: (open file, filename)
+    """
+    if self.bundle is not None:
+      fname = self.gp.gp.datafile()
+      return open(fname, 'wb'), fname
+    tmpdir = transfer_dir if os.path.isdir(transfer_dir) else None
+    fd, fname = tempfile.mkstemp(suffix = '.bin', prefix = 'ccsgp_', dir = tmpdir)
+    self._binfiles.append(fname)
+    return os.fdopen(fd, 'wb'), fname
+
+  def _serialize(self, d, cols):
+    """write dataset ``d`` to a binary file or gnuplot datablock (see _source)"""
+    lazy = is_lazy(d)
+    if self.transfer != 'text': # binary, also for out-of-core inline data
+      f, fname = self._binfile()
+      with f:
+        for c in (chunks(d) if lazy else [d]):
+          np.ascontiguousarray(c, dtype = np.float64).tofile(f)
+      source = '"%s" binary record=%d format="%s"' % (
+        fname, d.shape[0], '%float64' * d.shape[1]
+      )
+    else:
+      source = '$ccsgp%d' % len(self._datablocks)
+      self.gp.stream(self._datablock(source, d, cols)) # chunk by chunk
+      self._datablocks.append(source)
+    return source
+
+  def _datablock(self, source, d, cols):
+    """ascii datablock definition w/ columns ``cols`` of dataset ``d``
+    (also out-of-core), formatted in chunks of rows (see postproc.format_rows)
+    """
+    yield '%s << EOD\n' % source
+    for c in chunks(d):
+      for s in postproc.format_rows(c[:, cols], '%.17g'): yield s
+    yield 'EOD\n'
+
+  def _items(self, d, layers):
+    """gnuplot plot items for all layers of dataset ``d``
+
+    * text: the columns used by any of the layers are uploaded once as named
+      datablock, each layer references it w/ its own using spec
+    * binary: the array is written once to a file in transfer_dir and read
+      via gnuplot's ``binary format=`` syntax, C-contiguous float64 arrays
+      are written w/o copy
+    * inline: ascii data inlined in every plot command (for gnuplot < 5),
+      also used for data which isn't a 2D numeric array
+    * out-of-core data (see lazy.py) is streamed to the datablock or binary
+      file chunk by chunk (binary for inline transfer)
+
+    :param d: dataset
+    :type d: numpy.array
+    :param layers: title, using and with\_ options for each plot item
+    :type layers: list of dict
+    :returns: list of Gnuplot.PlotItem
+    """
+    import Gnuplot # loaded on first use, see pool.py
+    if (self.transfer == 'inline' and not is_lazy(d)) or len(d.shape) != 2 or \
+       not np.issubdtype(d.dtype, np.number):
+      return [ Gnuplot.Data(d, inline = 1, **l) for l in layers ]
+    cols = range(d.shape[1])
+    if self.transfer == 'text':
+      cols = sorted(set.union(*[ _using_columns(l['using']) for l in layers ]))
+    source = self._source(d, cols)
+    items = []
+    for l in layers:
+      l = dict(l)
+      using = _remap_using(l.pop('using'), cols)
+      items.append(Gnuplot.Func('%s using %s' % (source, using), **l))
+    return items
+
+  def __del__(self):
+    self.close()
+
   def _get_style_mod_prop(self, prop):
     """get style and modified property string"""
     m = re.compile('^with \w+').search(prop)
@@ -64,10 +295,13 @@ class MyPlot(object):
     :returns: '1:2:3', '1:2:4' or '1:2:3:4'
     """
     if not prop: # primary errors
-      return ':'.join([
+      cols = [
         '%d' % (i+1) for i in xrange(4)
         if i < 2 or (i >= 2 and self.error_sums[i-2] > 0)
-      ])
+      ]
+      if self.axisLog['y'] and cols[-1] == '4': # limit arrows instead
+        cols[-1] = '(($2-$4)<0?0:$4)'
+      return ':'.join(cols)
     else: # secondary errors
       # filledcurves or candlesticka
       style, mod_prop = self._get_style_mod_prop(prop)
@@ -88,6 +322,7 @@ class MyPlot(object):
 
   def _sum_errs(self, data, i):
     """convenience function to calculate sum of i-th column"""
+    if is_lazy(data): return sum(c[:, i].sum() for c in chunks(data))
     return data[:, i].sum()
 
   def _plot_errs(self, data):
@@ -165,8 +400,9 @@ class MyPlot(object):
 
   def _prettify(self, str):
     """prettify string, remove special symbols"""
-    return re.compile(ur'[\W]+',re.UNICODE).sub('_',str.strip())
+    return postproc.prettify(str)
 
+  @timed('initData')
   def initData(self, data, properties, titles, subplot_title = None):
     """initialize the data
 
@@ -179,6 +415,9 @@ class MyPlot(object):
       specification in the form ``with <style>`` and if the style is in
       ccsgp.config.supported_styles (style specification has to be at the
       beginning of the property string!)
+    - datasets can be out-of-core (np.memmap, h5py datasets, see lazy.py),
+      they are processed and sent to gnuplot in chunks
+    - the datasets are never modified
 
     :param data: data points w/ format [x, y, dx, dy] for each dataset
     :type data: list of numpy arrays
@@ -189,9 +428,12 @@ class MyPlot(object):
     :param subplot_title: subplot title for panel plot case
     :type subplot_title: str
     :var dataSets: zipped titles and data for hdf5/ascii output and setAxisRange
+    :var dataStats: autoscaling statistics for each entry in dataSets
     :var data: list of Gnuplot.Data including extra data sets for error plotting
     """
-    # dataSets used in _hdf5/_ascii and setAxisRange
+    self.plotcmd = 'plot'
+    # dataSets used for the data export and setAxisRange
+    keys = []
     for i, (k, v) in enumerate(zip(titles, data)):
       key = k if k else 'graph' + str(i)
       if subplot_title is not None: # multiplot
@@ -200,59 +442,248 @@ class MyPlot(object):
         raise ValueError("duplicate key '{0}'!".format(k))
       else:
         self.dataSets[key] = v
-    # plot arrows for data points with error bars larger than resp. value
-    # TODO: lw/lt/lc are hardcoded! same for arrow length and offset.
-    arr_upp_prop = 'head size screen %g,90 lw 4 lt 1 lc 0 front' % self.arrow_bar
-    arr_low_prop = 'head empty lw 4 lt 1 lc 0 front'
+        keys.append(key)
+    # statistics for autoscaling (chunked for out-of-core data)
+    for key in keys: self.dataStats[key] = self._data_stats(self.dataSets[key])
+    # reduce plotted data to output resolution, dataSets keep full data
+    plot_data = [
+      self._decimated(d, self.dataStats[key]) if self.decimate else d
+      for d, key in zip(data, keys)
+    ]
+    self._layout_inputs = (keys, plot_data, properties, titles)
+    self._layout()
+
+  def _layout(self):
+    """plot items of the datasets given to initData for the current axes
+
+    limit arrows and using specs depend on the log axes, datasets already
+    sent to gnuplot are only referenced again (see _source)
+    """
+    keys, plot_data, properties, titles = self._layout_inputs
+    self._layout_logs = dict(self.axisLog)
+    # plot arrows for data points with error bars reaching below zero on log
+    # y-axis, their error bars are cut off in gnuplot (see _using)
+    limit_arrows = []
     if self.axisLog['y']:
-      for d in data:
-        mask =  d[:,1] - d[:,3] < 0
-        for dp in d[mask]:
-          arr_start = [ dp[0], dp[1] + dp[3] ]
-          if dp[1] > 0:
-            self.setArrow(
-              [ dp[0], dp[1] / self.arrow_offset ], arr_start, arr_upp_prop
-            )
-            self.setArrow(
-              [ dp[0], dp[1] * self.arrow_offset ],
-              [ dp[0], self.arrow_length * dp[1] ], arr_low_prop
-            )
-          elif arr_start[1] > 0:
-            self.setArrow(
-              [dp[0], (self.arrow_length + 0.1) * arr_start[1]], arr_start, arr_upp_prop
-            )
-            self.setArrow(
-              arr_start, [dp[0], self.arrow_length * arr_start[1]], arr_low_prop
-            )
-          else: print 'point omitted:', dp
-        d[:,3][mask] = 0
+      for pd in plot_data:
+        if pd.shape[1] < 4: continue
+        if is_lazy(pd):
+          pd = np.concatenate([ c[c[:,1] - c[:,3] < 0] for c in chunks(pd) ])
+          limit_arrows += self._limit_arrows(pd, np.ones(len(pd), dtype = bool))
+        else:
+          limit_arrows += self._limit_arrows(pd, pd[:,1] - pd[:,3] < 0)
     # zip all input parameters for easier looping
-    zipped = zip(data, properties, titles)
-    # main data points drawn last
-    main_data = [
-      Gnuplot.Data(
-        d, inline = 1, title = t, using = '1:2',
-        with_ = self._with_main(p)
-      ) for d, p, t in zipped
-    ]
-    # extra data set to plot "primary" errors separately
-    prim_errs = [
-      Gnuplot.Data(
-        d, inline = 1, using = self._using(d),
-        with_ = self._with_errs(d, p)
-      ) if self._plot_errs(d) else None
-      for d, p, t in zipped
+    zipped = zip(plot_data, properties, titles)
+    # layers for each dataset: extra data set for "secondary" errors
+    # (systematic uncertainties), extra data set to plot "primary" errors
+    # separately and main data points drawn last. None's are filtered out.
+    layers = [
+      [
+        dict(using = self._using(d, p), with_ = self._with_syserrs(p))
+        if self._plot_syserrs(d) else None,
+        dict(using = self._using(d), with_ = self._with_errs(d, p))
+        if self._plot_errs(d) else None,
+        dict(title = t, using = '1:2', with_ = self._with_main(p))
+      ] for d, p, t in zipped
     ]
-    # extra data set for "secondary" errors (systematic uncertainties)
-    sec_errs = [
-      Gnuplot.Data(
-        d, inline = 1, using = self._using(d, p),
-        with_ = self._with_syserrs(p)
-      ) if self._plot_syserrs(d) else None
-      for d, p, t in zipped
+    # each dataset sent to gnuplot only once, limit arrows on top
+    self.data = deque([
+      item for d, l in zip(plot_data, layers)
+      for item in self._items(d, filter(None, l))
+    ] + limit_arrows)
+    self._base_data = list(self.data)
+
+  def updateLayout(self):
+    """recompute autoscaling statistics, limit arrows and using specs if the
+    log axes changed since initData (e.g. variants of repeat_plots)
+
+    the data isn't decimated again, i.e. keeps the pixel columns of the axes
+    it was initialized w/
+
+    :returns: True if the plot items were rebuilt
+    """
+    if self._layout_inputs is None: return False
+    if self._layout_logs == self.axisLog: return False
+    for key in self._layout_inputs[0]:
+      self.dataStats[key] = self._data_stats(self.dataSets[key])
+    self._layout()
+    return True
+
+  @timed('initData')
+  def initMap(self, z, xedges, yedges, subplot_title = None, style = None):
+    """initialize a 2D map (heatmap)
+
+    - z[i, j] is the value of the bin [xedges[j], xedges[j+1]] x
+      [yedges[i], yedges[i+1]], i.e. rows along y (``np.histogram2d(x, y,
+      ...)[0].T``)
+    - the matrix is always sent to gnuplot as binary file, chunk by chunk for
+      out-of-core data (see lazy.py)
+    - 'image': float64 ``binary array=`` drawn w/ plot, fastest, needs
+      equidistant bins on linear axes
+    - 'pm3d': float32 ``binary matrix`` of the bin corners drawn w/ splot
+      (view map), for variable bins and log axes
+    - call setAxisLogs before, the axis ranges default to the outer edges
+      (see make_map), zero/negative values are left blank on a log color
+      axis (see setColorbox)
+
+    :param z: values of the bins
+    :type z: numpy.array (2D)
+    :param xedges: bin edges along x (one more than columns of z)
+    :type xedges: numpy.array
+    :param yedges: bin edges along y (one more than rows of z)
+    :type yedges: numpy.array
+    :param subplot_title: subplot title for panel plot case
+    :type subplot_title: str
+    :param style: 'image', 'pm3d' or None to choose by the bins
+    :type style: str
+    """
+    import Gnuplot # loaded on first use, see pool.py
+    if not is_lazy(z): z = np.asarray(z)
+    xedges = np.asarray(xedges, dtype = np.float64)
+    yedges = np.asarray(yedges, dtype = np.float64)
+    ny, nx = z.shape
+    if len(xedges) != nx + 1 or len(yedges) != ny + 1:
+      raise ValueError('%dx%d map needs %d x- and %d y-edges!' % (
+        ny, nx, nx + 1, ny + 1
+      ))
+    key = 'map' if subplot_title is None else '_'.join([subplot_title, 'map'])
+    entries = map_datasets(key, z, xedges, yedges)
+    if any(k in self.dataSets for k in entries):
+      raise ValueError("duplicate key '{0}'!".format(key))
+    self.dataSets.update(entries)
+    if style is None:
+      uniform = lambda e: np.allclose(np.diff(e), e[1] - e[0])
+      style = 'image' if uniform(xedges) and uniform(yedges) and not (
+        self.axisLog['x'] or self.axisLog['y']
+      ) else 'pm3d'
+    if style not in ['image', 'pm3d']:
+      raise ValueError("unknown map style '{0}'!".format(style))
+    f, fname = self._binfile()
+    with self.timer.stage('serialize'):
+      with f: source = getattr(self, '_%s_source' % style)(f, fname, z, xedges, yedges)
+    if style == 'pm3d': self._setter(['view map', 'pm3d corners2color c1'])
+    self.plotcmd = 'plot' if style == 'image' else 'splot'
+    self._layout_inputs = None
+    self.data = deque([Gnuplot.Func(source, title = '', with_ = style)])
+    self._base_data = list(self.data)
+
+  def _image_source(self, f, fname, z, xedges, yedges):
+    """write z as float64 array, pixels centered in equidistant bins"""
+    for c in chunks(z) if is_lazy(z) else [z]:
+      np.ascontiguousarray(c, dtype = np.float64).tofile(f)
+    dx, dy = xedges[1] - xedges[0], yedges[1] - yedges[0]
+    return '"%s" binary array=(%d,%d) dx=%r dy=%r origin=(%r,%r) format="%%float64"' % (
+      fname, z.shape[1], z.shape[0], dx, dy,
+      xedges[0] + dx / 2., yedges[0] + dy / 2.
+    )
+
+  def _pm3d_source(self, f, fname, z, xedges, yedges):
+    """write the bin corners as gnuplot's nonuniform float32 binary matrix
+
+    the first row holds the number of columns and the x-edges, each further
+    row a y-edge and the values at the corners. A corner gets the value of
+    the bin it is the lower left corner of (``corners2color c1``), the last
+    row/column repeats the last bin.
+    """
+    np.r_[len(xedges), xedges].astype(np.float32).tofile(f)
+    i, last = 0, None
+    for c in chunks(z) if is_lazy(z) else [z]:
+      c = np.asarray(c, dtype = np.float64)
+      np.column_stack((yedges[i:i+len(c)], c, c[:, -1])).astype(np.float32).tofile(f)
+      i, last = i + len(c), c[-1]
+    np.r_[yedges[-1], last, last[-1]].astype(np.float32).tofile(f)
+    return '"%s" binary matrix' % fname
+
+  def setColorbox(self, **kwargs):
+    """set palette and color axis of 2D maps
+
+    * ``palette``: gnuplot palette specification (default see config)
+    * ``zr``: range of the color axis, autoscaled if omitted
+    * ``zlog``: logarithmic color axis
+    * ``zlabel``: label of the color box
+    """
+    self._setter(['palette %s' % kwargs.get('palette', map_palette)])
+    if kwargs.get('zlog'): self._setter(['logscale cb', 'format cb "10^{%L}"'])
+    else:
+      self.gp('unset logscale cb')
+      self.gp('set format cb "%g"')
+    zr = kwargs.get('zr')
+    self.gp('set cbrange [%s]' % ('*:*' if zr is None else '%e:%e' % tuple(zr)))
+    self.gp('set cblabel "%s"' % kwargs.get('zlabel', ''))
+
+  def _decimated(self, d, stats):
+    """dataset ``d`` decimated to the output resolution (see setDecimation)
+
+    :param stats: statistics of d (see _data_stats)
+    :type stats: dict
+    """
+    log = self.axisLog['x']
+    if self.decimate_range is not None: # visible window only
+      xrange = tuple(sorted(self.decimate_range))
+      parts = in_range(chunks(d) if is_lazy(d) else [d], xrange)
+      if is_lazy(d):
+        return decimate_chunks(parts, self.decimate, self.npix, xrange, log = log)
+      return decimate(
+        np.concatenate(list(parts)), self.decimate, self.npix, log = log,
+        xrange = xrange
+      )
+    if not is_lazy(d): return decimate(d, self.decimate, self.npix, log = log)
+    x = stats['x']
+    if x is None: return np.asarray(d[0:0])
+    xrange = (x[3], x[1]) if log and x[3] is not None else (x[0], x[1])
+    return decimate_chunks(chunks(d), self.decimate, self.npix, xrange, log = log)
+
+  def setDecimation(self, method, ncols = 1, xrange = None):
+    """decimate plotted data to the pixel resolution of the output
+
+    :param method: None, 'minmax' or 'lttb' (see decimate.py)
+    :type method: str
+    :param ncols: number of panel columns sharing the output width
+    :type ncols: int
+    :param xrange: explicit x-axis range (``xr``), only points within it
+      (and their neighbours) are decimated over its pixel columns
+    :type xrange: list
+    """
+    self.decimate = method
+    self.decimate_range = xrange
+    if self.size is None: self.size = default_size
+    self.npix = int(self._dims('inch')[0] * raster_density / ncols)
+
+  def _limit_arrows(self, d, mask):
+    """arrows for points whose error bar reaches below zero on log y-axis
+
+    * two extra datasets drawn w/ gnuplot's vectors style: upper arrows end
+      in a bar at y+dy, lower arrows point towards zero (arrow_length)
+    * start points are offset from the data point by arrow_offset
+    * points w/ y+dy <= 0 can't be drawn and are omitted
+
+    :param d: one dataset
+    :type d: numpy.array
+    :param mask: points for which to draw arrows
+    :type mask: numpy.array
+    :returns: list of Gnuplot.PlotItem
+    """
+    # TODO: lw/lt/lc are hardcoded!
+    arr_upp_prop = 'head size screen %g,90 lw 4 lt 1 lc 0' % self.arrow_bar
+    arr_low_prop = 'head empty lw 4 lt 1 lc 0'
+    x, y = d[:,0][mask], d[:,1][mask]
+    top = y + d[:,3][mask]
+    pos = y > 0
+    keep = pos | (top > 0)
+    for dp in d[mask][~keep]: print 'point omitted:', dp
+    x, y, top, pos = x[keep], y[keep], top[keep], pos[keep]
+    if not len(x): return []
+    upp_start = np.where(pos, y / self.arrow_offset, (self.arrow_length + 0.1) * top)
+    low_start = np.where(pos, y * self.arrow_offset, top)
+    low_end = self.arrow_length * np.where(pos, y, top)
+    return [
+      self._items(
+        np.column_stack((x, start, np.zeros(len(x)), end - start)),
+        [ dict(title = '', using = '1:2:3:4', with_ = 'vectors ' + prop) ]
+      )[0] for start, end, prop in [
+        (upp_start, top, arr_upp_prop), (low_start, low_end, arr_low_prop)
+      ]
     ]
-    # zip main & secondary data and filter out None's
-    self.data = deque(filter(None, zip_flat(sec_errs, prim_errs, main_data)))
 
   def _setter(self, list):
     """convenience function to set a list of gnuplot options
@@ -284,6 +715,68 @@ class MyPlot(object):
     """
     self._setter(['key %s' % s for s in key_opts])
 
+  def _ybounds(self, v):
+    """y-values and their lower/upper ends incl. errors
+
+    y-errors are the larger of statistical and systematic error per point,
+    statistical errors of points w/ limit arrows (log y-axis) are ignored
+
+    :returns: (y, y - errors, y + errors)
+    """
+    y = v[:, 1]
+    e = np.zeros(len(v))
+    if v.shape[1] >= 4:
+      e = v[:, 3]
+      if self.axisLog['y']: e = np.where(y - e < 0, 0., e)
+      if v.shape[1] > 4: e = np.maximum(e, v[:, 4])
+    return y, y - e, y + e
+
+  def _data_stats(self, v):
+    """statistics of one dataset used for autoscaling
+
+    only the extrema for the full dataset are cached, the y-statistics
+    restricted to an x-range are computed from the dataset on demand (see
+    _ystats)
+
+    :param v: one dataset
+    :type v: numpy.array
+    :returns: dict w/ dataset, extrema (see _extrema) and min/max of x
+    """
+    if is_lazy(v): return self._lazy_stats(v)
+    x = v[:, 0]
+    return {
+      'src': v,
+      'xmin': x.min() if len(x) else None, 'xmax': x.max() if len(x) else None,
+      'x': _extrema(x, x, x), 'y': _extrema(*self._ybounds(v))
+    }
+
+  def _lazy_stats(self, v):
+    """chunked _data_stats of an out-of-core dataset
+
+    only the extrema are kept, the data is re-read if the y-statistics are
+    restricted to an x-range (see _ystats)
+    """
+    stats = { 'src': v, 'xmin': None, 'xmax': None, 'x': None, 'y': None }
+    for c in chunks(v):
+      s = self._data_stats(c)
+      if s['xmin'] is None: continue
+      if stats['xmin'] is None: stats['xmin'], stats['xmax'] = s['xmin'], s['xmax']
+      else:
+        stats['xmin'] = min(stats['xmin'], s['xmin'])
+        stats['xmax'] = max(stats['xmax'], s['xmax'])
+      for k in ['x', 'y']: stats[k] = _merge_extrema(stats[k], s[k])
+    return stats
+
+  def _ystats(self, s, xr):
+    """y-extrema of one dataset for points within x-range ``xr``"""
+    if s['xmin'] is None: return None
+    if xr[0] < s['xmin'] and s['xmax'] < xr[1]: return s['y']
+    v, ext = s['src'], None
+    for c in chunks(v) if is_lazy(v) else [v]:
+      c = c[(c[:, 0] > xr[0]) & (c[:, 0] < xr[1])]
+      ext = _merge_extrema(ext, _extrema(*self._ybounds(c)))
+    return ext
+
   def setAxisRange(self, rng, axis = 'x', reverse = False):
     """set range for specified axis
 
@@ -299,31 +792,33 @@ class MyPlot(object):
     :param reverse: reverse axis range
     :type reverse: bool
     """
-    if rng is None:
-      col = int(axis == 'y')
-      all_data = self.dataSets.values()
-      vals = np.array([ n for v in all_data for n in v[:, col] ])
-      evals = np.zeros(len(vals))
-      if axis == 'y':
-        evals = np.array([
-          max(n) if v.shape[1] >= 4 else 0.
-          for v in all_data for n in v[:, 3:]
-        ])
-        xvals = np.array([n for v in all_data for n in v[:, 0]])
-        mask = (xvals > self.axisRange['x'][0]) & (xvals < self.axisRange['x'][1])
-        vals = vals[mask]
-        evals = evals[mask]
-      axMin = (vals-evals).min()
-      if self.axisLog[axis] and not axMin > 0: axMin = vals.min()
-      axMax = (vals+evals).max()
-      add_rng = 0.1 * (axMax - axMin)
-      rng = [
-        axMin - add_rng if not self.axisLog[axis] else 0.9 * axMin,
-        axMax + add_rng if not self.axisLog[axis] else 1.1 * axMax,
-      ]
+    if rng is None: rng = self._autoscale(axis)
     self.axisRange[axis] = rng
     self.gp('set %srange [%e:%e] %s' % (axis, rng[0], rng[1], 'reverse' if reverse else ''))
 
+  @timed('autoscale')
+  def _autoscale(self, axis):
+    """axis range including all data points (see setAxisRange)"""
+    if axis == 'x':
+      ext = [ s['x'] for s in self.dataStats.itervalues() ]
+    else:
+      ext = [
+        self._ystats(s, self.axisRange['x'])
+        for s in self.dataStats.itervalues()
+      ]
+    ext = [ e for e in ext if e is not None ]
+    if not ext: raise ValueError('no data points to determine %s-range!' % axis)
+    axMin, axMax = min(e[0] for e in ext), max(e[1] for e in ext)
+    if self.axisLog[axis] and not axMin > 0:
+      axMin = min(e[2] for e in ext)
+      pos = [ e[3] for e in ext if e[3] is not None ]
+      if not axMin > 0 and pos: axMin = min(pos)
+    add_rng = 0.1 * (axMax - axMin)
+    return [
+      axMin - add_rng if not self.axisLog[axis] else 0.9 * axMin,
+      axMax + add_rng if not self.axisLog[axis] else 1.1 * axMax,
+    ]
+
   def setAxisLabel(self, label, axis = 'x'):
     """set label for specified axis
 
@@ -380,6 +875,12 @@ class MyPlot(object):
     :param opts: line draw options
     :type opts: str
     """
+    import Gnuplot
+    if self.plotcmd == 'splot': # no 2D data items in pm3d maps
+      self.setArrow(
+        [self.axisRange['x'][0], y], [self.axisRange['x'][1], y], 'nohead ' + opts
+      )
+      return
     d = np.array([ [self.axisRange['x'][i], y] for i in xrange(2) ])
     self.data.appendleft(Gnuplot.Data(
       d, inline = 1, title = '', using = '1:2', with_ = ' '.join(['lines', opts])
@@ -420,12 +921,39 @@ class MyPlot(object):
       )
     )
 
+  def resetOverlays(self):
+    """remove labels, arrows and vertical lines (e.g. before a replot)"""
+    self.gp('unset label')
+    self.gp('unset arrow')
+    self.nLabels = self.nArrows = self.nVertLines = 0
+
   def setErrorArrows(self, **kwargs):
     """reset properties of arrows used to plot special errors"""
     self.arrow_offset = kwargs.get('arrow_offset', self.arrow_offset)
     self.arrow_length = kwargs.get('arrow_length', self.arrow_length)
     self.arrow_bar = kwargs.get('arrow_bar', self.arrow_bar)
 
+  def setExport(self, **kwargs):
+    """reset data export options
+
+    * ``hdf5_store``: write data into group ``name`` of this shared hdf5
+      file instead of ``name.hdf5``
+    * ``hdf5_mode``: 'overwrite' or 'append' the group in hdf5_store
+    * ``export_format``: 'dat' (ascii), 'npy', 'npz' or None (no export)
+    * ``export_precision``: digits after the decimal point for 'dat'
+    * ``export_background``: don't wait for the export (see
+      postproc.wait_exports)
+    """
+    self.hdf5_store = kwargs.get('hdf5_store', self.hdf5_store)
+    self.hdf5_mode = kwargs.get('hdf5_mode', self.hdf5_mode)
+    if self.hdf5_mode not in ['overwrite', 'append']:
+      raise ValueError("unknown hdf5 mode '{0}'!".format(self.hdf5_mode))
+    for k in ['export_format', 'export_precision', 'export_background']:
+      setattr(self, k, kwargs.get(k, getattr(self, k)))
+    if self.export_format not in ['dat', 'npy', 'npz', None]:
+      raise ValueError("unknown export format '{0}'!".format(self.export_format))
+
+  @timed('prepare_plot')
   def prepare_plot(self, margins=True, **kwargs):
     """prepare for plotting (calls all members of MyPlot)"""
     if self.size is None:
@@ -446,78 +974,114 @@ class MyPlot(object):
       self.setLabel(k, v[:2], v[-1])
     for a in kwargs.get('arrows', []): self.setArrow(*a)
 
-  def _convert(self):
-    """convert eps/ps original into pdf, png and jpg format"""
-    pdf_dims = [
-      int(ureg.parse_expression(s).to('point').magnitude)
-      for s in self.size.split(',')
-    ]
-    call(' '.join([
-      'gs', '-dBATCH', '-dNOPAUSE',
-      '-sOutputFile=%s.pdf' % (self.name),
-      '-sDEVICE=pdfwrite',
-      '-dDEVICEWIDTHPOINTS=%d' % (pdf_dims[1]),
-      '-dDEVICEHEIGHTPOINTS=%d' % (pdf_dims[0]),
-      '-c "<</PageOffset [-50 -50]>> setpagedevice"',
-      '-f', self.epsname
-    ]), shell = True)
-    for ext in ['.png', '.jpg']:
-      call(' '.join([
-        'convert -density 150', self.name + '.pdf', self.name + ext
-      ]), shell = True)
-
-  def _hdf5(self):
-    """write data contained in plot to HDF5 file
-
-    - easy numpy import -> (savetxt) -> gnuplot
-    - export to ROOT objects
-
-    h5py howto (see http://www.h5py.org/docs/intro/quick.html):
-      - open file: `f = h5py.File(name, 'r')`
-      - list datasets: `list(f)`
-      - load entire dataset as np array: `arr = f['dset_name'][...]`
-      - NOTE: literally type the 3 dots, replace dset_name
-      - np.savetxt format: `fmt = '%.4f %.3e %.3e %.3e %.3e'`
-      - save array to txt file: `np.savetxt('arr.dat', arr, fmt=fmt)`
-
-    :raises: ImportError
-    """
-    try:
-      import h5py
-      f = h5py.File(self.name + '.hdf5', 'w')
-      for k, v in self.dataSets.iteritems():
-        f.create_dataset(k, data = v)
-      f.close()
-    except ImportError:
-      print 'install h5py to also save an hdf5 file of your plot!'
-    except:
-      print 'h5py imported but error raised!'
-      raise
-
-  def _ascii(self):
-    """write ascii file(s) w/ data contained in plot"""
-    if not os.path.exists(self.name): os.makedirs(self.name)
-    for k, v in self.dataSets.iteritems():
-      np.savetxt(
-        self.name + '/' + self._prettify(k) + '.dat', v, fmt='%.4e'
+  def _dims(self, unit, size = None):
+    """width and height of the output in given unit
+
+    :param unit: pint unit, e.g. 'cm', 'inch', 'point'
+    :type unit: str
+    :param size: size string '<height>,<width>', defaults to self.size
+    :type size: str
+    :returns: [width, height]
+    """
+    return size_dims(self.size if size is None else size, unit)
+
+  def _terminal(self, fmt, transparent = False):
+    """gnuplot terminal setting for direct output in format ``fmt``
+
+    :param fmt: 'eps' (panels), 'ps', 'pdf', 'png' or 'svg'
+    :type fmt: str
+    :param transparent: transparent background (png, e.g. panel tiles)
+    :type transparent: bool
+    :returns: string for gnuplot's set command
+    """
+    if fmt == 'ps':
+      return 'terminal postscript landscape enhanced color 24 size %s' % self.size
+    if fmt == 'eps':
+      return 'terminal postscript eps enhanced color "Helvetica" 24 size %fcm,%fcm' % (
+        tuple(self._dims('cm'))
+      )
+    if fmt == 'pdf':
+      return 'terminal pdfcairo enhanced color font "Helvetica,24" size %fin,%fin' % (
+        tuple(self._dims('inch'))
+      )
+    if fmt == 'png':
+      w, h = [ int(d * raster_density) for d in self._dims('inch') ]
+      return 'terminal pngcairo %senhanced color font "Helvetica,24" fontscale %g size %d,%d' % (
+        'transparent ' if transparent else '', raster_density / 72., w, h
       )
+    if fmt == 'svg':
+      return 'terminal svg enhanced font "Helvetica,24" size %d,%d' % (
+        tuple(int(d) for d in self._dims('point'))
+      )
+    raise ValueError("unknown output format '{0}'!".format(fmt))
+
+  def outputs(self):
+    """files written by a hardcopy of this plot (w/o ascii directory)"""
+    if self.backend == 'ps':
+      files = [self.epsname] + [ self.name + ext for ext in ['.pdf', '.png', '.jpg'] ]
+    elif self.nPanels > 0:
+      files = [ self.name + ext for ext in ['.pdf', '.png'] ]
+    else:
+      files = [ '%s.%s' % (self.name, fmt) for fmt in cairo_formats ]
+    return files + ([self.name + '.hdf5'] if self.hdf5_store is None else [])
+
+  def _hardcopy(self, wait = True):
+    """generate eps, convert to other formats and write data to hdf5
 
-  def _hardcopy(self):
-    """generate eps, convert to other formats and write data to hdf5"""
+    * ps backend: pdf conversion and data export start right away, png and
+      jpg are rasterized concurrently once the pdf exists
+    * cairo backend: gnuplot writes all cairo_formats itself, panels are only
+      written to pdf (see make_panel) and rasterized to png afterwards
+    * the stages work on a snapshot of name, size and data so that the plot
+      can be modified/repeated while they are running
+    * in compile-only mode the hardcopy is only recorded in the bundle
+
+    :param wait: wait for all post-processing stages to finish
+    :type wait: bool
+    :returns: postproc.PostProcess or None in compile-only mode
+    """
     if self.nPanels < 1:
       #self.gp.hardcopy(
       #  self.epsname, enhanced = 1, color = 1, mode = 'landscape', fontsize = 24
       #)
-      self._setter([
-        'terminal postscript landscape enhanced color 24 size %s' % self.size,
-        'output "%s"' % self.epsname,
-      ])
-      self.gp.refresh()
-    self._convert()
-    self._hdf5()
-    self._ascii()
-
-  def plot(self, hardcopy = True):
-    """plot and generate output files"""
-    self.gp.plot(*self.data)
-    if hardcopy: self._hardcopy()
+      outputs = [
+        ('ps', self.epsname)
+      ] if self.backend == 'ps' else [
+        (fmt, '%s.%s' % (self.name, fmt)) for fmt in cairo_formats
+      ]
+      with self.timer.stage('hardcopy'):
+        for fmt, outname in outputs:
+          self._setter([self._terminal(fmt), 'output "%s"' % outname])
+          self.gp.refresh()
+          self.gp('set output')
+    hardcopy = dict(
+      name = self.name, epsname = self.epsname, size = self.size,
+      backend = self.backend, panel = self.nPanels > 0,
+      hdf5_store = self.hdf5_store, hdf5_mode = self.hdf5_mode,
+      export_format = self.export_format,
+      export_precision = self.export_precision,
+      export_background = self.export_background
+    )
+    if self.bundle is not None:
+      self.gp.flush()
+      self.gp.gp.add_hardcopy(hardcopy, self.dataSets)
+      return None
+    self.gp.sync() # output files closed before post-processing reads them
+    self.postprocess = postproc.hardcopy(
+      dataSets = dict(self.dataSets), timer = self.timer, **hardcopy
+    )
+    self.postprocess.files = self.outputs()
+    if wait: self.postprocess.wait()
+    return self.postprocess
+
+  def plot(self, hardcopy = True, wait = True):
+    """plot and generate output files
+
+    :param hardcopy: generate output files
+    :type hardcopy: bool
+    :param wait: block until all output files are written
+    :type wait: bool
+    :returns: postproc.PostProcess handle of the hardcopy stages or None
+    """
+    with self.timer.stage('plot'): getattr(self.gp, self.plotcmd)(*self.data)
+    if hardcopy: return self._hardcopy(wait = wait)
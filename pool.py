@@ -0,0 +1,131 @@
+"""
+pool of long-lived gnuplot sessions shared by all MyPlot instances
+
+* ``acquire`` hands out an idle session (hit) or spawns a new one (miss)
+* ``release`` resets the session state and puts it back into the pool
+* sessions idle for more than ``timeout`` seconds are closed on the next call
+  to ``acquire`` or ``release``, the pool never keeps more than ``size``
+  idle sessions around
+
+:var gnuplot_pool: module-wide pool used by MyPlot
+"""
+
+import time, threading
+from config import pool_size, pool_timeout
+
+class GnuplotPool(object):
+  """pool of warm Gnuplot.Gnuplot sessions
+
+  :param size: maximum number of idle sessions kept in the pool
+  :type size: int
+  :param timeout: idle time in seconds after which a session is closed
+  :type timeout: float
+  :ivar hits: number of acquires served by an idle session
+  :ivar misses: number of acquires which had to spawn a new session
+  :ivar spawns: total number of gnuplot processes started
+  """
+  def __init__(self, size = pool_size, timeout = pool_timeout):
+    self.size = size
+    self.timeout = timeout
+    self.hits = 0
+    self.misses = 0
+    self.spawns = 0
+    self._idle = [] # list of (gp, time of release)
+    self._lock = threading.Lock()
+
+  def configure(self, size = None, timeout = None):
+    """change pool size and/or idle timeout
+
+    :param size: maximum number of idle sessions
+    :type size: int
+    :param timeout: idle timeout in seconds
+    :type timeout: float
+    """
+    with self._lock:
+      if size is not None: self.size = size
+      if timeout is not None: self.timeout = timeout
+      self._reap()
+
+  def _reap(self):
+    """close sessions which are idle for too long or exceed pool size"""
+    now = time.time()
+    alive, expired = [], []
+    for gp, t in self._idle:
+      if self.timeout is None or now - t < self.timeout: alive.append((gp, t))
+      else: expired.append((gp, t))
+    n = max(len(alive) - self.size, 0) # oldest sessions beyond size
+    expired += alive[:n]
+    self._idle = alive[n:]
+    for gp, t in expired: self._close(gp)
+
+  def _close(self, gp):
+    """terminate a gnuplot session, ignoring broken pipes"""
+    try: gp.close()
+    except (IOError, OSError): pass
+
+  def acquire(self, debug = 0):
+    """get a gnuplot session with clean state
+
+    :param debug: debug flag for verbose gnuplot output
+    :type debug: bool
+    :returns: Gnuplot.Gnuplot
+    """
+    with self._lock:
+      self._reap()
+      if self._idle:
+        gp, t = self._idle.pop()
+        self.hits += 1
+        gp.debug = debug
+        return gp
+      self.misses += 1
+      self.spawns += 1
+    import Gnuplot # loaded on first use
+    return Gnuplot.Gnuplot(debug = debug)
+
+  def release(self, gp):
+    """reset gnuplot session state and return it to the pool
+
+    :param gp: session previously obtained via acquire
+    :type gp: Gnuplot.Gnuplot
+    """
+    try:
+      gp('unset multiplot')
+      gp('set output')
+      gp('reset')
+      gp('unset label')
+      gp('unset arrow')
+      gp('unset object')
+      gp('set terminal dumb')
+    except (IOError, OSError): # gnuplot died, don't recycle
+      self._close(gp)
+      return
+    with self._lock:
+      self._idle.append((gp, time.time()))
+      self._reap()
+
+  def detach(self):
+    """forget idle sessions inherited from a parent process (after fork)
+
+    the gnuplot processes still belong to the parent, so they are dropped
+    without being closed
+    """
+    self._idle = []
+    self._lock = threading.Lock()
+
+  def clear(self):
+    """close all idle sessions"""
+    with self._lock:
+      for gp, t in self._idle: self._close(gp)
+      self._idle = []
+
+  def stats(self):
+    """hit/miss and spawn counters
+
+    :returns: dict w/ hits, misses, spawns and idle
+    """
+    return {
+      'hits': self.hits, 'misses': self.misses,
+      'spawns': self.spawns, 'idle': len(self._idle)
+    }
+
+gnuplot_pool = GnuplotPool()
@@ -0,0 +1,459 @@
+"""
+overlapped post-processing of hardcopies (pdf/png/jpg conversion, data export)
+
+each stage runs in its own thread as soon as the stages it depends on are
+finished, e.g. png and jpg rasterization both wait for the pdf while the data
+export runs right away.
+"""
+
+import os, re, sys, fcntl, threading, Queue
+import numpy as np
+from subprocess import Popen
+from config import raster_density, run_converters, batch_converters
+from utils import size_dims, convert_length
+from timing import add_child_usage
+from lazy import is_lazy, chunks
+from gsbatch import gs_batch
+
+def _run(cmd):
+  """run shell command and account its resource usage (see timing.py)"""
+  p = Popen(cmd, shell = True)
+  pid, status, ru = os.wait4(p.pid, 0)
+  p.returncode = status
+  add_child_usage(ru)
+
+class PostProcess(object):
+  """handle for a set of running post-processing stages
+
+  :param timer: records the stages' timing (see timing.StageTimer)
+  :type timer: timing.StageTimer
+  :ivar errors: exc_info tuples of failed stages
+  :ivar files: output files of the hardcopy (w/o ascii export)
+  """
+  def __init__(self, timer = None):
+    self._stages = []
+    self.errors = []
+    self.timer = timer
+    self.files = []
+
+  def submit(self, func, args = (), deps = (), stage = None):
+    """start ``func(*args)`` in a thread once all ``deps`` are finished
+
+    a stage is skipped if one of its dependencies failed
+
+    :param func: stage to run
+    :type func: callable
+    :param args: arguments for func
+    :type args: tuple
+    :param deps: stages returned by earlier calls to submit
+    :type deps: list
+    :param stage: stage name for timing records
+    :type stage: str
+    :returns: threading.Thread
+    """
+    if stage is not None and self.timer is not None:
+      func = self.timer.wrap(stage, func)
+    def run():
+      for d in deps: d.join()
+      if any(getattr(d, 'failed', False) for d in deps):
+        stage.failed = True
+        return
+      try: func(*args)
+      except Exception:
+        stage.failed = True
+        self.errors.append(sys.exc_info())
+    stage = threading.Thread(target = run)
+    stage.daemon = True
+    stage.start()
+    self._stages.append(stage)
+    return stage
+
+  def then(self, func, args = ()):
+    """run ``func(*args)`` once all stages submitted so far succeeded"""
+    return self.submit(func, args, deps = list(self._stages))
+
+  def done(self):
+    """whether all stages are finished"""
+    return not any(s.is_alive() for s in self._stages)
+
+  def wait(self):
+    """wait for all stages and re-raise the first error"""
+    for s in self._stages: s.join()
+    if self.errors:
+      exc_type, exc, tb = self.errors[0]
+      raise exc_type, exc, tb
+
+def prettify(str):
+  """prettify string, remove special symbols"""
+  return re.compile(ur'[\W]+',re.UNICODE).sub('_',str.strip())
+
+def convert_pdf(name, epsname, size):
+  """convert eps/ps original into pdf format"""
+  pdf_dims = [
+    int(convert_length(s, 'point'))
+    for s in size.split(',')
+  ]
+  _run(' '.join([
+    'gs', '-dBATCH', '-dNOPAUSE',
+    '-sOutputFile=%s.pdf' % (name),
+    '-sDEVICE=pdfwrite',
+    '-dDEVICEWIDTHPOINTS=%d' % (pdf_dims[1]),
+    '-dDEVICEHEIGHTPOINTS=%d' % (pdf_dims[0]),
+    '-c "<</PageOffset [-50 -50]>> setpagedevice"',
+    '-f', epsname
+  ]))
+
+def convert_raster(name, ext):
+  """convert pdf into raster format given by extension ``ext``"""
+  _run(' '.join([
+    'convert -density %d' % raster_density, name + '.pdf', name + ext
+  ]))
+
+def composite_tiles(name, tiles, size):
+  """flatten transparent full-size png tiles onto a white canvas (name.png)
+
+  :param name: basename of output file
+  :type name: str
+  :param tiles: png files in drawing order
+  :type tiles: list
+  :param size: size string '<height>,<width>'
+  :type size: str
+  """
+  w, h = [ int(d * raster_density) for d in size_dims(size, 'inch') ]
+  _run(' '.join(
+    ['convert', '-size %dx%d' % (w, h), 'xc:white'] +
+    [ '"%s"' % t for t in tiles ] + ['-flatten', name + '.png']
+  ))
+
+def convert_png(name, ext):
+  """convert png (e.g. composited panel) into format given by extension ``ext``"""
+  _run(' '.join([
+    'convert -units PixelsPerInch -density %d' % raster_density,
+    name + '.png', name + ext
+  ]))
+
+def write_hdf5(name, dataSets):
+  """write data contained in plot to HDF5 file
+
+  - easy numpy import -> (savetxt) -> gnuplot
+  - export to ROOT objects
+
+  h5py howto (see http://www.h5py.org/docs/intro/quick.html):
+    - open file: `f = h5py.File(name, 'r')`
+    - list datasets: `list(f)`
+    - load entire dataset as np array: `arr = f['dset_name'][...]`
+    - NOTE: literally type the 3 dots, replace dset_name
+    - np.savetxt format: `fmt = '%.4f %.3e %.3e %.3e %.3e'`
+    - save array to txt file: `np.savetxt('arr.dat', arr, fmt=fmt)`
+
+  :param name: basename of output file
+  :type name: str
+  :param dataSets: datasets to write, out-of-core datasets are copied in
+    chunks (see lazy.py)
+  :type dataSets: dict
+  :raises: ImportError
+  """
+  try:
+    import h5py
+    f = h5py.File(name + '.hdf5', 'w')
+    for k, v in dataSets.iteritems():
+      if not is_lazy(v):
+        f.create_dataset(k, data = v)
+        continue
+      ds, n = f.create_dataset(k, shape = v.shape, dtype = v.dtype), 0
+      for c in chunks(v):
+        ds[n:n+len(c)] = c
+        n += len(c)
+    f.close()
+  except ImportError:
+    print 'install h5py to also save an hdf5 file of your plot!'
+  except:
+    print 'h5py imported but error raised!'
+    raise
+
+class _FileLock(object):
+  """exclusive lock on ``path`` (flock), blocks across threads & processes"""
+  def __init__(self, path):
+    self.path = path
+  def __enter__(self):
+    self.f = open(self.path, 'a')
+    fcntl.flock(self.f, fcntl.LOCK_EX)
+  def __exit__(self, *exc):
+    fcntl.flock(self.f, fcntl.LOCK_UN)
+    self.f.close()
+
+def write_hdf5_store(path, name, dataSets, mode = 'overwrite'):
+  """write data contained in plot into group ``name`` of a shared HDF5 file
+
+  * datasets are chunked and gzip compressed, rows can be appended
+  * mode 'overwrite' replaces the group, 'append' adds the rows to existing
+    datasets of the group (and creates missing ones)
+  * writers (threads, batch workers) are serialized via ``<path>.lock``
+  * out-of-core datasets are appended in chunks (see lazy.py)
+
+  :param path: shared HDF5 file
+  :type path: str
+  :param name: group name, usually the plot's basename
+  :type name: str
+  :param dataSets: datasets to write
+  :type dataSets: dict
+  :param mode: 'overwrite' or 'append'
+  :type mode: str
+  """
+  try:
+    import h5py
+  except ImportError:
+    print 'install h5py to also save an hdf5 file of your plot!'
+    return
+  with _FileLock(path + '.lock'):
+    f = h5py.File(path, 'a')
+    try:
+      if mode == 'overwrite' and name in f: del f[name]
+      grp = f.require_group(name)
+      for k, v in dataSets.iteritems():
+        for v in (chunks(v) if is_lazy(v) else [np.asarray(v)]):
+          if k in grp:
+            ds = grp[k]
+            n = ds.shape[0]
+            ds.resize(n + len(v), axis = 0)
+            ds[n:] = v
+          elif v.size:
+            grp.create_dataset(
+              k, data = v, chunks = True, compression = 'gzip', shuffle = True,
+              maxshape = (None,) + v.shape[1:]
+            )
+          else:
+            grp.create_dataset(k, data = v, maxshape = (None,) + v.shape[1:])
+    finally:
+      f.close()
+
+def format_rows(v, fmt, chunk = 65536):
+  """ascii lines of data w/ one format for all columns
+
+  rows are formatted in chunks by a single string formatting operation
+  instead of row by row (as np.savetxt does)
+
+  :param v: 1D or 2D data, also out-of-core (see lazy.py)
+  :type v: numpy.array
+  :param fmt: format of one value, e.g. '%.4e'
+  :type fmt: str
+  :param chunk: number of rows formatted at once
+  :type chunk: int
+  :returns: generator of strings (one per chunk)
+  """
+  if not is_lazy(v): v = np.asarray(v)
+  ncols = v.shape[1] if len(v.shape) > 1 else 1
+  row = ' '.join([fmt] * ncols) + '\n'
+  for c in chunks(v, chunk): yield (row * len(c)) % tuple(c.ravel().tolist())
+
+def savetxt(fname, v, precision = 4, chunk = 65536):
+  """fast replacement for np.savetxt w/ one %e format for all columns
+  (see format_rows)
+
+  :param fname: output file
+  :type fname: str
+  :param v: 1D or 2D data, also out-of-core (see lazy.py)
+  :type v: numpy.array
+  :param precision: number of digits after the decimal point
+  :type precision: int
+  :param chunk: number of rows formatted at once
+  :type chunk: int
+  """
+  with open(fname, 'w') as f:
+    for s in format_rows(v, '%%.%de' % precision, chunk): f.write(s)
+
+def write_ascii(name, dataSets, fmt = 'dat', precision = 4):
+  """write file(s) w/ data contained in plot
+
+  * 'dat': ascii file per dataset in directory ``name``
+  * 'npy': memory-mappable numpy file per dataset in directory ``name``
+  * 'npz': one numpy archive ``name.npz`` w/ all datasets (out-of-core
+    datasets are loaded into memory)
+
+  :param name: basename of output file(s)
+  :type name: str
+  :param dataSets: datasets to write
+  :type dataSets: dict
+  :param fmt: 'dat', 'npy' or 'npz'
+  :type fmt: str
+  :param precision: digits after the decimal point for 'dat'
+  :type precision: int
+  """
+  if fmt == 'npz':
+    np.savez(name + '.npz', **dict(
+      (prettify(k), v) for k, v in dataSets.iteritems()
+    ))
+    return
+  if not os.path.exists(name): os.makedirs(name)
+  for k, v in dataSets.iteritems():
+    fname = name + '/' + prettify(k)
+    if fmt == 'npy': save_npy(fname + '.npy', v)
+    else: savetxt(fname + '.dat', v, precision = precision)
+
+def save_npy(fname, v):
+  """np.save w/ out-of-core datasets copied in chunks (see lazy.py)"""
+  if not is_lazy(v): return np.save(fname, np.asarray(v))
+  out = np.lib.format.open_memmap(fname, mode = 'w+', dtype = v.dtype, shape = v.shape)
+  n = 0
+  for c in chunks(v):
+    out[n:n+len(c)] = c
+    n += len(c)
+  out.flush()
+  del out
+
+class _BackgroundWriter(object):
+  """single thread running export jobs in the order they were queued"""
+  def __init__(self):
+    self.detach()
+
+  def detach(self):
+    """forget queue and thread state inherited from a parent process (after
+    fork), the parent's writer thread doesn't exist in the child"""
+    self._queue = Queue.Queue()
+    self._thread = None
+    self._lock = threading.Lock()
+    self.errors = []
+
+  def submit(self, func, args):
+    with self._lock:
+      if self._thread is None:
+        self._thread = threading.Thread(target = self._run)
+        self._thread.daemon = True
+        self._thread.start()
+    self._queue.put((func, args))
+
+  def _run(self):
+    while True:
+      func, args = self._queue.get()
+      try: func(*args)
+      except Exception: self.errors.append(sys.exc_info())
+      finally: self._queue.task_done()
+
+  def wait(self):
+    """wait for all queued jobs and re-raise the first error"""
+    self._queue.join()
+    if self.errors:
+      (exc_type, exc, tb), self.errors = self.errors[0], []
+      raise exc_type, exc, tb
+
+background = _BackgroundWriter()
+
+def wait_exports():
+  """wait for all data exports running in the background"""
+  background.wait()
+
+def hardcopy(
+  name, epsname, size, backend, panel, dataSets,
+  hdf5_store = None, hdf5_mode = 'overwrite',
+  export_format = 'dat', export_precision = 4, export_background = False,
+  timer = None
+):
+  """start post-processing stages for a hardcopy written by gnuplot
+
+  * ps backend: pdf conversion and data export start right away, png and
+    jpg are rasterized concurrently once the pdf exists
+  * ps backend w/ ``batch_converters``: pdf, png and jpg are queued to the
+    long-lived gs processes of gsbatch.gs_batch concurrently (png/jpg
+    rendered from the postscript original)
+  * cairo backend: outputs are written by gnuplot, only panels (pdf) are
+    rasterized to png
+  * gs/convert are skipped if the module variable ``run_converters`` is off
+    (see config)
+
+  :param name: basename of output files
+  :type name: str
+  :param epsname: postscript original (ps backend)
+  :type epsname: str
+  :param size: size string '<height>,<width>'
+  :type size: str
+  :param backend: 'ps' or 'cairo'
+  :type backend: str
+  :param panel: whether the hardcopy is a multiplot panel
+  :type panel: bool
+  :param dataSets: datasets for hdf5/ascii output
+  :type dataSets: dict
+  :param hdf5_store: shared HDF5 file to write data into instead of
+    name.hdf5 (see write_hdf5_store)
+  :type hdf5_store: str
+  :param hdf5_mode: 'overwrite' or 'append' the group in hdf5_store
+  :type hdf5_mode: str
+  :param export_format: 'dat', 'npy', 'npz' or None (see write_ascii)
+  :type export_format: str
+  :param export_precision: digits after the decimal point for 'dat'
+  :type export_precision: int
+  :param export_background: run the export in the background writer thread
+    instead of as stage of the returned PostProcess (see wait_exports)
+  :type export_background: bool
+  :param timer: records the timing of all stages
+  :type timer: timing.StageTimer
+  :returns: PostProcess
+  """
+  pp = PostProcess(timer)
+  if run_converters and backend == 'ps' and batch_converters:
+    for ext in ['.pdf', '.png', '.jpg']:
+      pp.submit(gs_batch.convert, (name, epsname, size, ext), stage = 'gs' + ext)
+  elif run_converters and backend == 'ps':
+    pdf = pp.submit(convert_pdf, (name, epsname, size), stage = 'gs')
+    for ext in ['.png', '.jpg']:
+      pp.submit(
+        convert_raster, (name, ext), deps = [pdf], stage = 'convert' + ext
+      )
+  elif run_converters and panel:
+    pp.submit(convert_raster, (name, '.png'), stage = 'convert.png')
+  _export(
+    pp, name, dataSets, hdf5_store, hdf5_mode,
+    export_format, export_precision, export_background
+  )
+  return pp
+
+def tiled_hardcopy(
+  name, tiles, size, dataSets,
+  hdf5_store = None, hdf5_mode = 'overwrite',
+  export_format = 'dat', export_precision = 4, export_background = False,
+  timer = None
+):
+  """start post-processing stages for a panel composited from tiles
+
+  the tiles are flattened into name.png, pdf and jpg are converted from it
+  concurrently while the data export runs right away (export options see
+  hardcopy)
+
+  :param name: basename of output files
+  :type name: str
+  :param tiles: transparent full-size png tiles of the subplots
+  :type tiles: list
+  :param size: size string '<height>,<width>'
+  :type size: str
+  :param dataSets: datasets for hdf5/ascii output
+  :type dataSets: dict
+  :param timer: records the timing of all stages
+  :type timer: timing.StageTimer
+  :returns: PostProcess
+  """
+  pp = PostProcess(timer)
+  pp.files = [ name + ext for ext in ['.png', '.pdf', '.jpg'] ] + (
+    [name + '.hdf5'] if hdf5_store is None else []
+  )
+  png = pp.submit(composite_tiles, (name, tiles, size), stage = 'composite')
+  for ext in ['.pdf', '.jpg']:
+    pp.submit(convert_png, (name, ext), deps = [png], stage = 'convert' + ext)
+  _export(
+    pp, name, dataSets, hdf5_store, hdf5_mode,
+    export_format, export_precision, export_background
+  )
+  return pp
+
+def _export(
+  pp, name, dataSets, hdf5_store, hdf5_mode,
+  export_format, export_precision, export_background
+):
+  """submit hdf5 and ascii data export stages to ``pp``"""
+  if hdf5_store is None: pp.submit(write_hdf5, (name, dataSets), stage = 'hdf5')
+  else: pp.submit(
+    write_hdf5_store, (hdf5_store, name, dataSets, hdf5_mode), stage = 'hdf5'
+  )
+  if export_format is not None:
+    export = (name, dataSets, export_format, export_precision)
+    if not export_background: pp.submit(write_ascii, export, stage = 'ascii')
+    elif pp.timer is None: background.submit(write_ascii, export)
+    else: background.submit(pp.timer.wrap('ascii', write_ascii), export)
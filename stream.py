@@ -0,0 +1,219 @@
+"""
+live plots of datasets growing over time (e.g. monitoring of experiments)
+
+* data points are appended in chunks to growable per-dataset buffers
+* redraws are coalesced to at most ``max_rate`` per second, a redraw which is
+  due too early is deferred to a timer thread
+* hardcopies (see MyPlot._hardcopy) are written on their own, slower cadence
+  ``hardcopy_interval`` and never pile up while the previous one is still
+  being post-processed
+* memory stays bounded w/ a rolling ``window`` (last points only) or
+  ``max_points`` (older points are min-max decimated, see decimate.py)
+"""
+
+import time, threading
+import numpy as np
+from myplot import MyPlot
+from decimate import minmax
+from config import default_size
+
+class _Series(object):
+  """growable buffer of data points of one dataset
+
+  :param window: keep only the last ``window`` points
+  :type window: int
+  :param max_points: decimate older points once more are stored
+  :type max_points: int
+  :param log: logarithmic x-axis (for decimation)
+  :type log: bool
+  """
+  def __init__(self, window = None, max_points = None, log = False):
+    self.window = window
+    self.max_points = max_points
+    self.log = log
+    self.buf = None
+    self.n = 0
+
+  def append(self, chunk):
+    """append data points w/ format [x, y, dx, dy1, dy2]"""
+    if self.buf is None: self.buf = np.empty((max(1024, len(chunk)), chunk.shape[1]))
+    if chunk.shape[1] != self.buf.shape[1]:
+      raise ValueError('%d columns appended to dataset w/ %d!' % (
+        chunk.shape[1], self.buf.shape[1]
+      ))
+    if self.window is not None and len(chunk) >= self.window:
+      chunk, self.n = chunk[-self.window:], 0
+    if self.n + len(chunk) > len(self.buf): self._make_room(len(chunk))
+    self.buf[self.n:self.n+len(chunk)] = chunk
+    self.n += len(chunk)
+    if self.max_points is not None and self.n > self.max_points: self._downsample()
+
+  def _make_room(self, m):
+    """grow the buffer or drop points outside the rolling window"""
+    size = max(2 * len(self.buf), self.n + m)
+    if self.window is not None and size > 2 * self.window:
+      keep = self.window - m
+      old = self.buf[self.n-keep:self.n].copy()
+      if len(self.buf) < 2 * self.window:
+        self.buf = np.empty((2 * self.window, self.buf.shape[1]))
+      self.buf[:keep] = old
+      self.n = keep
+    else:
+      buf = np.empty((size, self.buf.shape[1]))
+      buf[:self.n] = self.buf[:self.n]
+      self.buf = buf
+
+  def _downsample(self):
+    """keep the newest max_points/2 points, decimate the older ones"""
+    nold = self.n - self.max_points / 2
+    old = minmax(self.buf[:nold], max(1, self.max_points / 8), log = self.log)
+    self.buf[:len(old)] = old
+    self.buf[len(old):len(old)+self.n-nold] = self.buf[nold:self.n].copy()
+    self.n = len(old) + self.n - nold
+
+  def view(self):
+    """current data points (no copy)"""
+    if self.buf is None: return None
+    lo = 0 if self.window is None else max(0, self.n - self.window)
+    return self.buf[lo:self.n]
+
+class StreamPlot(MyPlot):
+  """plot whose datasets grow over time
+
+  * options (name, title, axes, lines, labels, gpcalls ...) see make_plot,
+    autoscaling follows the data unless ``xr``/``yr`` are given
+  * the current data is drawn on ``terminal`` (e.g. 'wxt noraise' for a
+    window), hardcopies as in make_plot
+
+  :param properties: gnuplot property strings for each dataset
+  :type properties: list
+  :param titles: legend/key titles for each dataset
+  :type titles: list
+  :param max_rate: maximum number of redraws per second
+  :type max_rate: float
+  :param hardcopy_interval: seconds between hardcopies, None for hardcopies
+    on request only (see hardcopy)
+  :type hardcopy_interval: float
+  :param window: rolling window, number of latest points kept per dataset
+  :type window: int
+  :param max_points: decimate older points of a dataset beyond this number
+  :type max_points: int
+  :param terminal: gnuplot terminal for the live view
+  :type terminal: str
+  :ivar series: data buffer of each dataset
+  :ivar nDraws: number of redraws
+  """
+  def __init__(
+    self, properties, titles, max_rate = 1., hardcopy_interval = None,
+    window = None, max_points = None, terminal = 'dumb', **kwargs
+  ):
+    MyPlot.__init__(
+      self, name = kwargs.get('name', 'test'),
+      title = kwargs.get('title', ''), debug = kwargs.get('debug', 0),
+      backend = kwargs.get('backend'), transfer = kwargs.get('transfer')
+    )
+    self.kwargs = kwargs
+    self.properties, self.titles = properties, titles
+    self.series = [
+      _Series(window, max_points, kwargs.get('xlog', False)) for p in properties
+    ]
+    self.max_rate = max_rate
+    self.hardcopy_interval = hardcopy_interval
+    self.terminal = terminal
+    self.nDraws = 0
+    self.size = kwargs.get('size', default_size)
+    self.setDecimation(kwargs.get('decimate'), xrange = kwargs.get('xr'))
+    self.setErrorArrows(**kwargs)
+    self.setExport(**kwargs)
+    self.setAxisLogs(**kwargs)
+    self._pending = False
+    self._last_draw = 0.
+    self._last_hardcopy = time.time()
+    self._timer = None
+    self._lock = threading.RLock()
+
+  def append(self, i, chunk):
+    """append data points to the i-th dataset and redraw if due
+
+    :param i: index of the dataset
+    :type i: int
+    :param chunk: data point(s) w/ format [x, y, dx, dy1, dy2]
+    :type chunk: numpy.array
+    """
+    chunk = np.atleast_2d(np.asarray(chunk, dtype = np.float64))
+    with self._lock:
+      self.series[i].append(chunk)
+      self._pending = True
+    self.update()
+
+  def update(self, force = False):
+    """redraw if new data is pending, deferred if the last redraw was less
+    than 1/max_rate seconds ago
+
+    :param force: redraw right away
+    :type force: bool
+    :returns: True if redrawn
+    """
+    with self._lock:
+      if not self._pending or self.gp is None: return False
+      delay = self._last_draw + 1. / self.max_rate - time.time()
+      if delay > 0 and not force:
+        if self._timer is None:
+          self._timer = threading.Timer(delay, self._deferred)
+          self._timer.daemon = True
+          self._timer.start()
+        return False
+      self._draw()
+      return True
+
+  def _deferred(self):
+    with self._lock: self._timer = None
+    self.update()
+
+  def _draw(self, hardcopy = None):
+    """send the current data and plot, w/ hardcopy if due"""
+    now = time.time()
+    if hardcopy is None:
+      hardcopy = self.hardcopy_interval is not None and (
+        now - self._last_hardcopy >= self.hardcopy_interval
+      ) and (self.postprocess is None or self.postprocess.done())
+    current = [
+      (v, p, t) for v, p, t in zip(
+        [ s.view() for s in self.series ], self.properties, self.titles
+      ) if v is not None and len(v)
+    ]
+    self._pending = False
+    if not current: return
+    self._last_draw = now
+    self._drop_sources()
+    self.resetOverlays()
+    self.dataSets, self.dataStats = {}, {}
+    self.gp('set terminal %s' % self.terminal)
+    self.initData(*map(list, zip(*current)))
+    self.prepare_plot(**self.kwargs)
+    self._setter(self.kwargs.get('gpcalls', []))
+    self.nDraws += 1
+    self.plot(hardcopy = hardcopy, wait = False)
+    if hardcopy: self._last_hardcopy = now
+
+  def hardcopy(self, wait = True):
+    """draw the current data and write the output files right away
+
+    :param wait: block until all output files are written
+    :type wait: bool
+    :returns: postproc.PostProcess or None w/o data
+    """
+    with self._lock:
+      self._draw(hardcopy = True)
+      postprocess = self.postprocess
+    if wait and postprocess is not None: postprocess.wait()
+    return postprocess
+
+  def close(self):
+    """stop deferred redraws and hand the gnuplot session back to the pool"""
+    lock = getattr(self, '_lock', None)
+    if lock is None: return MyPlot.close(self)
+    with lock:
+      if self._timer is not None: self._timer.cancel()
+      self._timer = None
+      MyPlot.close(self)
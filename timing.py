@@ -0,0 +1,161 @@
+"""
+per-stage timing and resource instrumentation of the plotting pipeline
+
+each MyPlot records one dict per stage it runs through:
+
+* ``plot``/``stage``: basename of the plot and stage name, i.e. 'initData'
+  (incl. 'serialize'), 'prepare_plot' (incl. 'autoscale'), 'plot',
+  'hardcopy' (gnuplot output), 'gs', 'convert.<ext>' or 'gs.<ext>' (batched
+  conversion, see gsbatch.py), 'hdf5', 'ascii'
+* ``start``/``wall``: start time and wall time in seconds
+* ``cpu``: cpu time in seconds of the thread running the stage
+* ``maxrss``: peak resident memory of the process in MB at the end of the
+  stage (high-water mark)
+* ``child_cpu``/``child_maxrss``: cpu time and peak memory of external
+  programs run by the stage (gs, convert), not available for the long-lived
+  gs processes of batched conversion
+* ``commands``/``bytes``: gnuplot commands and bytes sent during the stage
+  (stages run in the calling thread only)
+
+gnuplot itself runs asynchronously, i.e. 'plot'/'hardcopy' measure the time
+to send commands and data, not gnuplot's rendering time.
+
+:var sink: JSON-lines file each record is appended to (None = off), see
+  set_sink
+:var last_batch: records of the last make_plots/make_panels batch
+"""
+
+import sys, time, json, resource, threading
+from contextlib import contextmanager
+from config import timing_sink
+
+sink = timing_sink
+last_batch = []
+
+_local = threading.local() # record of the stage running in this thread
+_sink_lock = threading.Lock()
+_RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', (
+  1 if sys.platform.startswith('linux') else resource.RUSAGE_SELF
+))
+
+def _cpu():
+  """cpu time of the calling thread (falls back to the process)"""
+  try: ru = resource.getrusage(_RUSAGE_THREAD)
+  except ValueError: ru = resource.getrusage(resource.RUSAGE_SELF)
+  return ru.ru_utime + ru.ru_stime
+
+def _maxrss():
+  """peak resident memory of the process in MB"""
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def set_sink(path):
+  """append all records to the JSON-lines file ``path`` (None = off)"""
+  global sink
+  sink = path
+
+def _emit(record):
+  if sink is None: return
+  with _sink_lock:
+    with open(sink, 'a') as f: f.write(json.dumps(record) + '\n')
+
+def add_child_usage(ru):
+  """account resource usage of a finished external program to the stage
+  running in the calling thread
+
+  :param ru: rusage as returned by os.wait4
+  :type ru: resource.struct_rusage
+  """
+  record = getattr(_local, 'record', None)
+  if record is None: return
+  record['child_cpu'] = record.get('child_cpu', 0.) + ru.ru_utime + ru.ru_stime
+  record['child_maxrss'] = max(record.get('child_maxrss', 0.), ru.ru_maxrss / 1024.)
+
+class StageTimer(object):
+  """collects the stage records of one plot (thread-safe)
+
+  :param name: basename of the plot
+  :type name: str
+  :param counters: returns gnuplot command/byte counters (see
+    gpbuffer.CommandBuffer.stats)
+  :type counters: callable
+  :ivar records: list of stage records in order of completion
+  """
+  def __init__(self, name, counters = None):
+    self.name = name
+    self.counters = counters
+    self.records = []
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def stage(self, stage, count = True):
+    """record wall/cpu time and memory of the enclosed code as ``stage``
+
+    :param stage: stage name
+    :type stage: str
+    :param count: also record gnuplot commands/bytes sent (see counters)
+    :type count: bool
+    """
+    record = { 'plot': self.name, 'stage': stage, 'start': time.time() }
+    count = count and self.counters is not None
+    if count: c0 = self.counters()
+    cpu0, outer = _cpu(), getattr(_local, 'record', None)
+    _local.record = record
+    try:
+      yield record
+    finally:
+      _local.record = outer
+      record['wall'] = time.time() - record['start']
+      record['cpu'] = _cpu() - cpu0
+      record['maxrss'] = _maxrss()
+      if count:
+        c1 = self.counters()
+        for k in ['commands', 'bytes']: record[k] = c1[k] - c0[k]
+      with self._lock: self.records.append(record)
+      _emit(record)
+
+  def wrap(self, stage, func):
+    """``func`` run as ``stage`` (e.g. for post-processing threads)"""
+    def timed(*args):
+      with self.stage(stage, count = False): return func(*args)
+    return timed
+
+  def summary(self):
+    """aggregated records of this plot (see aggregate)"""
+    with self._lock: return aggregate(self.records)
+
+def aggregate(records):
+  """per-stage statistics of a list of records
+
+  :returns: dict stage -> dict w/ count, total/mean/max wall time, total cpu
+    time (incl. external programs), peak memory and gnuplot commands/bytes
+  """
+  stats = {}
+  for r in records:
+    s = stats.setdefault(r['stage'], {
+      'count': 0, 'wall': 0., 'wall_max': 0., 'cpu': 0., 'maxrss': 0.,
+      'commands': 0, 'bytes': 0
+    })
+    s['count'] += 1
+    s['wall'] += r['wall']
+    s['wall_max'] = max(s['wall_max'], r['wall'])
+    s['cpu'] += r['cpu'] + r.get('child_cpu', 0.)
+    s['maxrss'] = max(s['maxrss'], r['maxrss'], r.get('child_maxrss', 0.))
+    s['commands'] += r.get('commands', 0)
+    s['bytes'] += r.get('bytes', 0)
+  for s in stats.itervalues(): s['wall_mean'] = s['wall'] / s['count']
+  return stats
+
+def batch_stats():
+  """aggregated records of the last make_plots/make_panels batch"""
+  return aggregate(last_batch)
+
+def timed(stage):
+  """decorator recording calls of a method as ``stage`` in the ``timer``
+  attribute (StageTimer) of its object
+  """
+  def decorator(method):
+    def wrapper(self, *args, **kwargs):
+      with self.timer.stage(stage): return method(self, *args, **kwargs)
+    wrapper.__name__, wrapper.__doc__ = method.__name__, method.__doc__
+    return wrapper
+  return decorator
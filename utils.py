@@ -1,5 +1,5 @@
-import itertools
-from config import default_colors
+import re, itertools
+from config import default_colors, ureg
 
 def getOpts(i):
   """convience function for easy access to gnuplot property string"""
@@ -46,3 +46,45 @@ def colorscale(hexstr, scalefactor = 1.4):
   g = clamp(g * scalefactor)
   b = clamp(b * scalefactor)
   return 'rgb "#%02x%02x%02x"' % (r, g, b)
+
+_lengths = { # common length units in points (1/72 inch as in pint)
+  'in': 72., 'inch': 72., 'inches': 72., 'cm': 72. / 2.54, 'mm': 72. / 25.4,
+  'm': 7200. / 2.54, 'pt': 1., 'point': 1., 'points': 1., 'bp': 1.
+}
+_length_re = re.compile(r'^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([A-Za-z]+)\s*$')
+_conversions = {}
+
+def convert_length(length, unit):
+  """convert a length string like '7in' or '24point' into ``unit``
+
+  * common units are converted via a built-in table, others via pint
+    (loaded on first use)
+  * results are memoized
+
+  :param length: number w/ unit
+  :type length: str
+  :param unit: target unit, e.g. 'cm', 'inch', 'point'
+  :type unit: str
+  :returns: float
+  """
+  key = (length, unit)
+  if key not in _conversions:
+    m = _length_re.match(length)
+    if m and m.group(2) in _lengths and unit in _lengths:
+      value = float(m.group(1)) * _lengths[m.group(2)] / _lengths[unit]
+    else:
+      value = float(ureg.parse_expression(length).to(unit).magnitude)
+    _conversions[key] = value
+  return _conversions[key]
+
+def size_dims(size, unit):
+  """width and height of a size string '<height>,<width>' in given unit
+
+  :param size: size string, e.g. '7in,10in'
+  :type size: str
+  :param unit: unit, e.g. 'cm', 'inch', 'point' (see convert_length)
+  :type unit: str
+  :returns: [width, height]
+  """
+  height, width = [ convert_length(s, unit) for s in size.split(',') ]
+  return [width, height]